@@ -4,57 +4,47 @@ import altair as alt
 import plotly.express as px
 import streamlit as st
 from datetime import datetime, timedelta
-from collections import defaultdict
-import re
 import numpy as np
+import os
+from urllib.parse import urlencode
+import chart_queries
+from chart_figures import figure_size, trajectory_figure
+from chart_index import RANGE_METRICS
+from data_loader import load_dataset, memoize, section_cache
+import profiling
+from profiling import profiled
+from subscriptions import subscription_store
+
+# Address of the JSON API (api.py) as seen from the browser: downloads are
+# streamed by its /api/export endpoint
+API_URL = os.environ.get("BILLBOARD_API_URL", "http://localhost:8000")
 
 # %%
+# Opt-in rerun profiling (BILLBOARD_PROFILE=1), see profiling.py
+profile_run = profiling.start_run()
+profile_run.section("load_data")
+
 # Load the data
-excel_file_name = "songs_df.xlsx"
-# Read the Excel file into a dictionary of dataframes
-songs_df = pd.read_excel(excel_file_name)
-excel_file_name = "genre_df.xlsx"
-# Read the Excel file into a dictionary of dataframes
-genre_df = pd.read_excel(excel_file_name)
+# Datasets are parsed once per process and shared read-only across sessions;
+# they are reloaded only when their files change on disk
+chart_store = load_dataset("charts")
+# songs_df holds one row per charted song (Artist, Song)
+songs_df = chart_store.songs.loc[chart_store.charted_song_ids]
+# Per-song genre bitmasks and the list of genres in bit order
+genre_index = load_dataset("genre_index")
+# Week -> chart slices and run-length song trajectories (the range counts
+# behind the longest-ranking section are read through chart_queries)
+week_index = load_dataset("week_index")
+song_trajectories = load_dataset("song_trajectories")
 
 #######################################################################################
 
 
-# Function to extract multiple artists from a single string
-def extract_artists(artist_string):
-    # Define a regex pattern to capture various separators
-    pattern = r",|&| and | with | featuring | x | X "
-
-    # Split the artist string based on the pattern
-    artists = re.split(pattern, artist_string, flags=re.IGNORECASE)
-
-    return artists
-
-
-# Function to check if the given date is a Sunday
-def is_sunday(date):
-    return (
-        date.weekday() == 6
-    )  # 6 corresponds to Sunday in Python's datetime module (0 is Monday)
-
-
-# Function to adjust the selected date to the previous Sunday if necessary
-def adjust_to_previous_sunday(selected_date):
-    # Check if the selected date is a Sunday, if not, find the previous Sunday
-    if not is_sunday(selected_date):
-        days_to_subtract = (
-            selected_date.weekday() + 1
-        )  # Calculate days to subtract to get to the previous Sunday
-        selected_date -= timedelta(
-            days=days_to_subtract
-        )  # Subtract days to get to the previous Sunday
-    return selected_date
-
-
-# Function to limit selectable dates based on date_list and adjust if needed
-def select_date_from_list(date_list):
-    min_date = pd.to_datetime(min(date_list))
-    max_date = pd.to_datetime(max(date_list))
+# Function to limit selectable dates to the stored chart weeks and resolve the
+# picked date to the nearest chart week on or before it
+def select_date_from_list(week_index):
+    min_date = week_index.weeks[0]
+    max_date = week_index.weeks[-1]
 
     selected_date = st.date_input(
         "Select a date to present",
@@ -62,14 +52,14 @@ def select_date_from_list(date_list):
         max_value=max_date,
         value=min_date,
     )
-    selected_date = adjust_to_previous_sunday(selected_date)
+    selected_date = week_index.resolve(selected_date)
 
     return selected_date
 
 
-def select_date_range(date_list):
-    min_date = pd.to_datetime(min(date_list))
-    max_date = pd.to_datetime(max(date_list))
+def select_date_range(week_index):
+    min_date = week_index.weeks[0]
+    max_date = week_index.weeks[-1]
 
     # Display a caption for the date selection
     st.caption("Select start and end dates")
@@ -80,7 +70,7 @@ def select_date_range(date_list):
         max_value=max_date,
         value=min_date,  # Change the default value to the minimum date
     )
-    start_date = adjust_to_previous_sunday(start_date)
+    start_date = week_index.resolve(start_date)
 
     end_date = st.date_input(
         f"Select end date:",
@@ -88,45 +78,59 @@ def select_date_range(date_list):
         max_value=max_date,
         value=max_date,  # Change the default value to the maximum date
     )
-    end_date = adjust_to_previous_sunday(end_date)
+    end_date = week_index.resolve(end_date)
 
     return start_date, end_date
 
 
+@profiled()
 def display_longest_ranking_songs(
-    filtered_songs_df, selected_start_date, selected_end_date
+    filtered_songs,
+    selected_start_date,
+    selected_end_date,
+    metric="weeks",
+    genre_key=None,
 ):
-    # Extract the columns corresponding to the selected dates
-    selected_columns = filtered_songs_df.loc[
-        :, str(selected_start_date) : str(selected_end_date)
-    ]
-
-    # Create a list of columns including song and artist columns
-    columns_to_display = ["Song", "Artist"] + list(selected_columns.columns)
-
-    # Display the table with the specified columns
-    # st.write(
-    #     f"""Longest Ranking Songs Between {selected_start_date.strftime("%Y-%m-%d")} - {selected_end_date.strftime("%Y-%m-%d")}) :"""
-    # )
-    # st.write(songs_df[columns_to_display])
+    # The chart only depends on the genre selection, the dates and the metric
+    chart = memoize(
+        "longest_ranking",
+        (genre_key, selected_start_date, selected_end_date, metric),
+        lambda: longest_ranking_chart(
+            filtered_songs, selected_start_date, selected_end_date, metric
+        ),
+    )
 
-    # Aggregate non-NA values and count
-    non_na_counts = filtered_songs_df[columns_to_display].T.count()
+    # Show the chart using Streamlit's Altair component
+    with profiling.current_run().span("altair_chart"):
+        st.altair_chart(chart, use_container_width=True)
 
-    # Select top 10 songs with the most non-NA values
-    top_10_songs = non_na_counts.sort_values(ascending=False).head(10)
 
-    # Extract song and artist names for the top 10 songs
-    top_10_song_artist = filtered_songs_df.loc[top_10_songs.index, ["Song", "Artist"]]
+# Function to build the bar chart of the 10 songs with the most weeks
+@profiled()
+def longest_ranking_chart(
+    filtered_songs, selected_start_date, selected_end_date, metric
+):
+    # Count the weeks of every filtered song between the selected dates with
+    # two binary searches per song over the precomputed range index, and keep
+    # the 10 songs with the most weeks
+    top_10_song_artist = chart_queries.longest_ranking(
+        selected_start_date,
+        selected_end_date,
+        metric,
+        song_ids=filtered_songs.index.to_numpy(),
+        limit=10,
+    )
 
     # Combine Song and Artist columns
     top_10_song_artist["Combined"] = (
-        top_10_song_artist["Song"] + ", " + top_10_song_artist["Artist"]
+        top_10_song_artist["Song"].astype(str)
+        + ", "
+        + top_10_song_artist["Artist"].astype(str)
     )
 
     # Create a DataFrame with top 10 songs and their counts
     top_10_counts = pd.DataFrame(
-        {"Song": top_10_song_artist["Combined"], "Count": top_10_songs}
+        {"Song": top_10_song_artist["Combined"], "Count": top_10_song_artist["Count"]}
     )
 
     # Create a bar chart using Altair
@@ -134,34 +138,129 @@ def display_longest_ranking_songs(
         alt.Chart(top_10_counts)
         .mark_bar()
         .encode(x="Count", y=alt.Y("Song", sort="-x"), tooltip=["Song", "Count"])
-        .properties(title=f"Top 10 Songs with Most Appearances")
+        .properties(title=f"Top 10 Songs by {RANGE_METRICS[metric][0]}")
         .configure_axis(labelFontSize=12)
     )
-
-    # Show the chart using Streamlit's Altair component
-    st.altair_chart(chart, use_container_width=True)
+    return chart
 
 
-def filter_songs_by_genre(selected_genres, genre_df, songs_df):
+@profiled()
+def filter_songs_by_genre(selected_genres, genre_index, songs_df, match="any"):
     if not selected_genres:
         # If no genres are selected, return the original songs_df
         return songs_df
-    # Filter genre_df based on selected_genres
-    filtered_genre_df = genre_df[["Artist"] + selected_genres]
-
-    # Get the list of artists associated with the selected genres
-    filtered_artists = filtered_genre_df[
-        filtered_genre_df[selected_genres].sum(axis=1) > 0
-    ]["Artist"].tolist()
+    # Resolve the selection to song ids with one bitwise test over the index
+    song_ids = genre_index.song_ids_for(selected_genres, match)
 
-    # Subset songs_df based on the filtered artists
-    filtered_songs_df = songs_df[songs_df["Artist"].isin(filtered_artists)]
+    # Subset songs_df based on the matching songs
+    filtered_songs_df = songs_df.loc[song_ids]
 
     return filtered_songs_df
 
 
+# Function to get the API link streaming the export of the filtered view
+def export_url(start, end, layout, export_format, genre_key):
+    params = {
+        "start": f"{start:%Y-%m-%d}",
+        "end": f"{end:%Y-%m-%d}",
+        "layout": layout,
+        "format": export_format,
+    }
+    if genre_key[0]:
+        params.update(genres=",".join(genre_key[0]), match=genre_key[1])
+    return f"{API_URL}/api/export?{urlencode(params)}"
+
+
+# Function to render a Plotly figure, recording its serialized size (what is
+# sent to the browser) when profiling
+def display_figure(fig):
+    profile_run = profiling.current_run()
+    with profile_run.span("plotly_chart"):
+        st.plotly_chart(fig)
+        if profiling.enabled:
+            profile_run.annotate(
+                figure_kb=round(figure_size(fig) / 1024, 1), traces=len(fig.data)
+            )
+
+
+# Function to show the debug panel with this rerun's section timings (and
+# figure sizes), the per-section percentiles so far and the section cache hit rates
+def display_profile_panel(records):
+    with st.sidebar.expander("Profiling", expanded=False):
+        st.write("This rerun:")
+        rerun = pd.DataFrame(records).set_index("section")
+        columns = ["depth", "wall_ms", "cpu_ms", "peak_kb", "figure_kb", "traces"]
+        st.dataframe(rerun[[c for c in columns if c in rerun.columns]])
+        st.write("All reruns in this process:")
+        st.dataframe(profiling.summary())
+        st.write("Section cache:")
+        st.dataframe(pd.DataFrame(section_cache.stats()).T)
+
+
+# Function to show the sidebar: navigation, email signup and credits
+def display_sidebar(profile_run):
+    profile_run.section("sidebar")
+    # Display an image at the top of the sidebar
+    st.sidebar.image("Kozminski.png", width=100)
+
+    # Add anchor links to the different plots in your app
+    st.sidebar.markdown(
+        """
+    ### Navigation
+    - [Top](#header)
+    - [Genre Selector](#genre_filter)
+    - [Charts](#charts)
+    - [One Song Rankings](#onesong)
+    - [Compare Song Rankings](#multisong)
+    - [Top Artists by # of Entries](#topartists)
+    - [All Songs by Artist](#allsongs)
+    - [Longest Ranking Song](#songbyappearance)
+    - [Download the Charts](#export)
+    """
+    )
+
+    # Display a text input for users to enter their email in the sidebar
+    user_email = st.sidebar.text_input(
+        "Enter your email to be notified when next year's charts are available:"
+    )
+
+    # Queue the user's email for the subscription store when submitted; it is
+    # written to the database in the background (see subscriptions.py)
+    if st.sidebar.button("Submit"):
+        if subscription_store.subscribe(user_email):
+            st.sidebar.success(
+                "Thank you! We'll notify you when next year's charts are available."
+            )
+        else:
+            st.sidebar.warning("Please enter a valid email address.")
+
+    # Add project description at the bottom of the sidebar with adjusted style
+    st.sidebar.markdown(
+        """
+    ---
+
+    <span style="font-size:smaller; opacity:0.75">
+    Created by Filip Sobota, Joanna Bańkowska, and Alon Benach
+    under the supervision of Jacek Mańko, Web Mining course, Kozmiński University 2023.
+    </span>
+    """,
+        unsafe_allow_html=True,
+    )
+
+
+# Function to log this rerun's timings and show them in the sidebar when
+# profiling
+def finish_rerun(profile_run):
+    records = profile_run.finish()
+    if profiling.enabled:
+        display_profile_panel(records)
+
+
 # %%
 def main():
+    profile_run = profiling.current_run()
+    profile_run.section("header")
+
     ### HEADER
     # Add an HTML anchor to link to this section
     st.markdown("<a name='header'></a>", unsafe_allow_html=True)
@@ -194,7 +293,11 @@ def main():
     # Display the header
     st.markdown(header_html, unsafe_allow_html=True)
 
+    ###################################SIDEBAR FEATURES###########################################
+    display_sidebar(profile_run)
+
     #######################################################################################
+    profile_run.section("genre_filter")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='genre_filter'></a>", unsafe_allow_html=True)
 
@@ -202,246 +305,231 @@ def main():
     st.write("### Filter the Entire Dashboard by Selected Genres")
 
     # Add a multiple-choice selector for genres
-    selected_genres = st.multiselect("Select genres:", genre_df.columns[2:].tolist())
+    selected_genres = st.multiselect("Select genres:", genre_index.genres)
+
+    # Choose whether songs must match any or all of the selected genres
+    genre_match = st.radio(
+        "Match songs with any or all of the selected genres:",
+        ["any", "all"],
+        horizontal=True,
+    )
+
+    # Section results below are memoized on the genre selection rather than
+    # on the filtered songs themselves
+    genre_key = (tuple(sorted(selected_genres)), genre_match)
 
     # Filter songs_df based on selected genres
-    filtered_songs_df = filter_songs_by_genre(selected_genres, genre_df, songs_df)
+    filtered_songs = memoize(
+        "genre_filter",
+        genre_key,
+        lambda: filter_songs_by_genre(
+            selected_genres, genre_index, songs_df, genre_match
+        ),
+    )
+
+    # Matching all of several genres may leave no song to show
+    if filtered_songs.empty:
+        st.info(
+            "No songs match all of the selected genres. "
+            "Select fewer genres or match any of them."
+        )
+        finish_rerun(profile_run)
+        return
     #######################################################################################
 
+    profile_run.section("weekly_chart")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='charts'></a>", unsafe_allow_html=True)
 
     # Placeholder for Lineplot for Songs by Artist
     st.write("### Present the Weekly Chart by a Selected Date")
 
-    date_list = filtered_songs_df.columns[2:]
-    selected_date = select_date_from_list(date_list)
-    selected_data = filtered_songs_df[
-        ["Artist", "Song", selected_date.strftime("%Y-%m-%d")]
-    ]
+    selected_date = select_date_from_list(week_index)
+
+    # Slice the selected week out of the week index, already ordered by rank
+    song_ids = filtered_songs.index.to_numpy()
 
-    # Filter the data based on the selected date
-    selected_data = selected_data.dropna(subset=[selected_date.strftime("%Y-%m-%d")])
+    def weekly_chart():
+        _, selected_data = chart_queries.weekly_chart(selected_date, song_ids)
 
-    # Set the selected date column as the index and arrange it in ascending order
-    selected_data.set_index(selected_date.strftime("%Y-%m-%d"), inplace=True)
-    selected_data.sort_index(inplace=True)
+        # Set the rank as the index, labelled with the selected date
+        selected_data = selected_data.set_index("rank")[["Artist", "Song"]]
+        selected_data.index.name = selected_date.strftime("%Y-%m-%d")
+        return selected_data
+
+    selected_data = memoize("weekly_chart", (genre_key, selected_date), weekly_chart)
 
     # Display the table without the index
     st.write(
         f"""Top 100 list for the selected week (week beginning on Sunday {selected_date.strftime("%Y-%m-%d")}) :"""
     )
     st.write(selected_data)
+
+    # Compare the selected week with the chart week before it
+    previous_date = week_index.resolve(selected_date - timedelta(days=1))
+    if previous_date < selected_date:
+        with st.expander(
+            f"""Changes since the previous chart ({previous_date.strftime("%Y-%m-%d")})"""
+        ):
+            changes = memoize(
+                "weekly_changes",
+                (genre_key, selected_date),
+                lambda: week_index.diff(previous_date, selected_date, song_ids),
+            )
+            st.write("New entries:")
+            st.write(changes["new"].set_index("rank")[["Artist", "Song"]])
+            st.write("Dropped out:")
+            st.write(changes["dropped"].set_index("rank")[["Artist", "Song"]])
+            st.write("Moved (positive = up):")
+            st.write(
+                changes["moved"].set_index("rank")[
+                    ["Artist", "Song", "rank_before", "change"]
+                ]
+            )
+
     ############################### PRESENT 1 SONG'S RANKINGS ########################################
+    profile_run.section("one_song")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='onesong'></a>", unsafe_allow_html=True)
 
     # Placeholder for Lineplot for Songs by Artist
     st.write("### Present the Ranking of a Song over Time")
 
-    # Allow the user to select a song from the dropdown menu
-    selected_song = st.selectbox("Select a song:", filtered_songs_df["Song"].unique())
-
-    # Filter data for the selected song
-    selected_song_data = filtered_songs_df[filtered_songs_df["Song"] == selected_song]
-
-    # Get the date columns and the corresponding ranks for the selected song
-    date_columns = selected_song_data.columns[
-        2:
-    ]  # Assuming dates start from the third column onwards
-    selected_song_ranks = selected_song_data.iloc[
-        0, 2:
-    ]  # Selecting the row corresponding to the selected song's ranks
-
-    # Create a DataFrame with date and rank columns for the plot
-    plot_data = pd.DataFrame({"Date": date_columns, "Rank": selected_song_ranks})
-
-    # Convert 'Date' column to datetime format
-    plot_data["Date"] = pd.to_datetime(plot_data["Date"])
-
-    # Fill NA values in 'Rank' column with 0
-    plot_data["Rank"].fillna(0, inplace=True)
-
-    # Get indices of non-zero values in 'Rank' column
-    nonzero_indexes = plot_data[plot_data["Rank"] != 0].index
-
-    # Trim the DataFrame to include data between first and last non-zero appearances
-    if len(nonzero_indexes) > 0:
-        start_index = nonzero_indexes[0]
-        end_index = nonzero_indexes[-1]
-        plot_data = plot_data.loc[start_index:end_index]
-
-    # Replace NA values in 'Rank' column with NaN
-    plot_data["Rank"] = plot_data["Rank"].replace(0, np.nan)
-
-    # Create a line plot using Plotly Express without connecting NA values
-    fig = px.line(
-        plot_data,
-        x="Date",
-        y="Rank",
-        title=f'Popularity of {selected_song} by {selected_song_data["Artist"].iloc[0]}',
-        labels={"Date": "Date", "Rank": "Rank"},
-    )
-
-    # Set y-axis to be reversed
-    fig.update_yaxes(autorange="reversed", scaleanchor="x", scaleratio=1)
-
-    # Filter the data to get only existing (non-NA) ranks for x-axis ticks
-    existing_ranks = plot_data.dropna(subset=["Rank"])
-    existing_dates = existing_ranks["Date"]
+    # Search the filtered songs on the server and offer only the top matches,
+    # labelled "Song — Artist" (the most popular songs before anything is typed)
+    song_query = st.text_input("Search songs:", key="song_query")
+    song_matches = chart_queries.search_songs(song_query, filtered_songs.index)
+    if song_matches.empty:
+        st.caption(f"No songs match '{song_query}'; showing the most popular songs.")
+        song_matches = chart_queries.search_songs("", filtered_songs.index)
+    song_ids_by_label = pd.Series(song_matches.index, index=song_matches["label"])
+
+    # Allow the user to select a song from the matches
+    selected_song = st.selectbox("Select a song:", song_ids_by_label.index)
+
+    selected_song_id = song_ids_by_label[selected_song]
+    selected_song_title = songs_df.at[selected_song_id, "Song"]
+
+    # The figure only depends on the selected song
+    def song_figure():
+        # Expand the selected song's chart runs into (Date, Rank) rows; the NaN
+        # rows between runs keep the line from connecting gaps in its chart history
+        plot_data = song_trajectories.frame([selected_song_id])
+
+        # Plot within the song's own chart history, with a bounded set of ticks
+        fig = trajectory_figure(
+            plot_data,
+            title=f'Popularity of {selected_song_title} by {songs_df.at[selected_song_id, "Artist"]}',
+        )
+        fig.update_yaxes(scaleanchor="x", scaleratio=1)
+        return fig
 
-    # Customize x-axis tick labels to show years and months for existing dates only
-    fig.update_xaxes(
-        tickvals=existing_dates,
-        tickformat="%Y-%m-%d",
-        tickangle=45,
-        title_text="Date",
-    )
-    # Manually set y-axis tick labels to replace 0 with 1
-    fig.update_yaxes(
-        tickvals=[1, 20, 40, 60, 80, 100],  # Adjust tick values as needed
-        ticktext=[1, 20, 40, 60, 80, 100],  # Replace 0 with 1 in tick labels
-    )
+    fig = memoize("one_song", selected_song_id, song_figure)
 
     # Display the chart using st.plotly_chart
-    st.plotly_chart(fig)
+    display_figure(fig)
+
+    # Show the song's statistics from the rollups computed at ingest
+    stats = chart_queries.song_stats(selected_song_id)
+    st.caption(
+        f"Weeks on chart: {stats['weeks_on_chart']} | Peak: #{stats['peak']} | "
+        f"Weeks in the top 10: {stats['weeks_top10']} | "
+        f"Weeks at #1: {stats['weeks_at_1']} | "
+        f"Debut: {stats['debut_week']:%Y-%m-%d} | Last week: {stats['exit_week']:%Y-%m-%d}"
+    )
 
     ############################### COMPARE SONGS RANKINGS ##################################
+    profile_run.section("compare_songs")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='multisong'></a>", unsafe_allow_html=True)
 
     # Placeholder for Lineplot for Songs by Artist
     st.write("### Compare the Rankings of Multiple Songs over Time")
 
-    default_songs = filtered_songs_df["Song"].unique()[
-        :3
-    ]  # Get the first three songs as default placeholders
+    # The selection is kept across searches; the options are the selected
+    # songs followed by the top matches of the current search
+    if "compare_song_ids" not in st.session_state:
+        # Get the three most popular songs as default placeholders
+        st.session_state["compare_song_ids"] = list(
+            chart_queries.search_songs("", filtered_songs.index, limit=3).index
+        )
+    compare_query = st.text_input("Search songs to compare:", key="compare_query")
+    compare_ids = pd.Index(st.session_state["compare_song_ids"]).append(
+        chart_queries.search_songs(compare_query, filtered_songs.index).index
+    )
+    compare_labels = chart_queries.song_labels(compare_ids.unique())
+    song_ids_by_label = pd.Series(compare_labels.index, index=compare_labels.to_numpy())
 
-    # Allow the user to select multiple songs from the dropdown menu
+    # Allow the user to select multiple songs from the matches
     selected_songs = st.multiselect(
-        "Select songs:", filtered_songs_df["Song"].unique(), default=default_songs
+        "Select songs:",
+        song_ids_by_label.index,
+        default=list(compare_labels[st.session_state["compare_song_ids"]]),
     )
+    st.session_state["compare_song_ids"] = list(song_ids_by_label[selected_songs])
 
     if len(selected_songs) > 0:
-        # Filter data for the selected songs
-        selected_songs_data = filtered_songs_df[songs_df["Song"].isin(selected_songs)]
-
-        # Initialize variables to track the first and last existing observations
-        min_date = pd.Timestamp.max
-        max_date = pd.Timestamp.min
-
-        # Create an empty DataFrame to store combined plot data
-        combined_plot_data = pd.DataFrame(columns=["Date", "Rank", "Song"])
-
-        # Iterate through selected songs to collect their data
-        for song in selected_songs:
-            # Filter data for the current selected song
-            current_song_data = selected_songs_data[selected_songs_data["Song"] == song]
-
-            # Get the date columns and the corresponding ranks for the selected song
-            date_columns = current_song_data.columns[
-                2:
-            ]  # Assuming dates start from the third column onwards
-            current_song_ranks = current_song_data.iloc[
-                0, 2:
-            ]  # Selecting the row corresponding to the selected song's ranks
-
-            # Create a DataFrame with date and rank columns for the plot
-            plot_data = pd.DataFrame(
-                {
-                    "Date": date_columns,
-                    "Rank": current_song_ranks,
-                    "Song": f"{song}, {current_song_data['Artist'].iloc[0]}",
-                }
+        selected_song_ids = song_ids_by_label[selected_songs].to_numpy()
+
+        # The figure only depends on the selected songs, in selection order
+        def compare_figure():
+            # Expand the chart runs of all selected songs into one long frame
+            combined_plot_data = song_trajectories.frame(selected_song_ids)
+
+            # Plot every selected song between the first and last existing
+            # observations within them, each labelled with its song and artist
+            fig = trajectory_figure(
+                combined_plot_data,
+                title="Comparison of Song Popularity",
+                labels=chart_queries.song_labels(selected_song_ids),
+                max_traces=len(selected_song_ids),
             )
+            return fig
 
-            # Convert 'Date' column to datetime format
-            plot_data["Date"] = pd.to_datetime(plot_data["Date"])
-
-            # Fill NA values in 'Rank' column with NaN
-            plot_data["Rank"] = pd.to_numeric(plot_data["Rank"], errors="coerce")
-
-            # Append plot data for the current song to combined plot data
-            combined_plot_data = combined_plot_data.append(plot_data, ignore_index=True)
-
-            # Update min_date and max_date based on existing observations for the current song
-            song_min_date = plot_data.dropna(subset=["Rank"])["Date"].min()
-            song_max_date = plot_data.dropna(subset=["Rank"])["Date"].max()
-            if song_min_date < min_date:
-                min_date = song_min_date
-            if song_max_date > max_date:
-                max_date = song_max_date
-
-        # Create a line plot using Plotly Express for multiple songs comparison
-        fig = px.line(
-            combined_plot_data,
-            x="Date",
-            y="Rank",
-            color="Song",
-            title="Comparison of Song Popularity",
-            labels={"Date": "Date", "Rank": "Rank"},
-        )
-
-        # Set y-axis to be reversed
-        fig.update_yaxes(autorange="reversed")
-
-        # Customize x-axis tick labels to show every second month
-        month_ticks = pd.date_range(start=min_date, end=max_date, freq="2M")
-        fig.update_xaxes(
-            tickvals=month_ticks, tickformat="%Y-%m-%d", tickangle=45, title_text="Date"
-        )
+        fig = memoize("compare_songs", tuple(selected_song_ids), compare_figure)
 
-        # Set the x-axis range based on the first and last existing observation dates within selected songs
-        fig.update_xaxes(range=[min_date, max_date])
-        # Manually set y-axis tick labels to replace 0 with 1
-        fig.update_yaxes(
-            tickvals=[1, 20, 40, 60, 80, 100],  # Adjust tick values as needed
-            ticktext=[1, 20, 40, 60, 80, 100],  # Replace 0 with 1 in tick labels
-        )
         # Display the chart using st.plotly_chart
-        st.plotly_chart(fig)
+        display_figure(fig)
     else:
         st.write("Please select one or more songs.")
 
     ############################# Number of Appearances for Top Artists #############################
+    profile_run.section("top_artists")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='topartists'></a>", unsafe_allow_html=True)
 
     # Placeholder for Lineplot for Songs by Artist
     st.write("### See the Number of Appearances for Top Artists (1990-2022)")
 
-    # Initialize a defaultdict to count artist appearances
-    artist_appearances = defaultdict(int)
-
-    # Iterate through each song to count artist appearances
-    for song, artist in zip(filtered_songs_df["Song"], filtered_songs_df["Artist"]):
-        # Extract individual artists from the song based on separators
-        artists = extract_artists(artist)
-
-        # Increment the appearance count for each artist
-        for artist_name in artists:
-            artist_appearances[artist_name.strip()] += 1
+    # The counts and the figure only depend on the genre selection
+    def top_artists_figure():
+        # Count the songs credited to each performer, once: without a genre
+        # selection the counts come from the per-performer rollups
+        song_ids = None if genre_key[0] == () else filtered_songs.index.to_numpy()
+        all_artists = chart_queries.top_artists(song_ids, limit=None)
+        song_counts = all_artists["Number of Appearances"].sort_index()
+
+        # Get the top 100 artists by their number of songs
+        top_artists = all_artists.head(100)
+
+        # Create a bar plot for top 100 artists
+        fig = px.bar(
+            top_artists,
+            x="Number of Appearances",
+            y="Artist",
+            orientation="h",
+            title="Top 100 Artists in Billboard100 by Number of Appearances",
+            labels={"Number of Appearances": "Number of Appearances"},
+        )
+        return song_counts, fig
 
-    # Convert the defaultdict to a DataFrame and get the top 100 artists
-    top_artists = pd.DataFrame(
-        artist_appearances.items(), columns=["Artist", "Number of Appearances"]
-    )
-    top_artists = top_artists.nlargest(100, "Number of Appearances")
-
-    # Create a bar plot for top 100 artists
-    fig = px.bar(
-        top_artists,
-        x="Number of Appearances",
-        y="Artist",
-        orientation="h",
-        title="Top 100 Artists in Billboard100 by Number of Appearances",
-        labels={"Number of Appearances": "Number of Appearances"},
-    )
+    song_counts, fig = memoize("top_artists", genre_key, top_artists_figure)
 
     # Display the chart using st.plotly_chart
-    st.plotly_chart(fig)
+    display_figure(fig)
 
     ################################# ALL SONGS BY AN ARTIST #################################
+    profile_run.section("artist_songs")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='allsongs'></a>", unsafe_allow_html=True)
 
@@ -449,129 +537,107 @@ def main():
     st.write("### Present Rankings of all Songs by an Artist Throughout the Year")
 
     ### Create a lineplot for all songs by artist
-    # Expand the DataFrame to include rows for each artist
-    expanded_artists = filtered_songs_df.assign(
-        Artist=filtered_songs_df["Artist"].apply(extract_artists)
-    ).explode("Artist")
-
-    # Get the list of unique artists from the expanded DataFrame
-    unique_artists = expanded_artists["Artist"].unique()
+    # Search the performers credited on at least one of the filtered songs and
+    # offer only the top matches (the most charted artists before anything is typed)
+    artist_ids = np.flatnonzero(song_counts.to_numpy() > 0)
+    artist_query = st.text_input("Search artists:", key="artist_query")
+    artist_matches = chart_queries.search_artists(artist_query, artist_ids)
+    if artist_matches.empty:
+        st.caption(
+            f"No artists match '{artist_query}'; showing the most charted artists."
+        )
+        artist_matches = chart_queries.search_artists("", artist_ids)
+    unique_artists = artist_matches["Artist"]
 
-    # Allow the user to select an artist from the dropdown menu
+    # Allow the user to select an artist from the matches
     selected_artist = st.selectbox("Select an artist:", unique_artists)
 
-    # Filter data for the selected artist
-    selected_artist_data = expanded_artists[
-        expanded_artists["Artist"] == selected_artist
-    ]
-
-    # Melt the DataFrame to reshape the data for plotting
-    melted_data = pd.melt(
-        selected_artist_data,
-        id_vars=["Artist", "Song"],
-        var_name="Date",
-        value_name="Rank",
-    )
+    performer_id = unique_artists.index[unique_artists.to_numpy() == selected_artist][0]
 
-    # Sort the melted data by date
-    melted_data["Date"] = pd.to_datetime(melted_data["Date"])
-    melted_data = melted_data.sort_values("Date")
-
-    # Filter the data to keep only rows where 'Rank' is not NA
-    filtered_data = melted_data.dropna(subset=["Rank"])
-
-    # Get the first and last non-NA dates for the selected artist
-    first_date = filtered_data["Date"].min()
-    last_date = filtered_data["Date"].max()
-
-    # Create a line plot using Plotly Express
-    fig = px.line(
-        filtered_data,
-        x="Date",
-        y="Rank",
-        color="Song",
-        title=f"Ranking Over Time for Songs by {selected_artist}",
-        labels={"Date": "Date", "Rank": "Rank", "Song": "Song"},
-    )
+    # The figure only depends on the genre selection and the artist
+    def artist_figure():
+        # Look up the selected artist's songs in the credit index
+        selected_song_ids = chart_queries.artist_song_ids(
+            performer_id, filtered_songs.index.to_numpy()
+        )
 
-    # Set y-axis to be reversed
-    fig.update_yaxes(autorange="reversed")
+        # Expand the artist's songs into (Date, Rank) rows of charted weeks only
+        filtered_data = song_trajectories.frame(selected_song_ids, gaps=False)
 
-    # Set x-axis range to the first and last non-NA dates
-    fig.update_xaxes(range=[first_date, last_date])
+        # Plot between the artist's first and last charted weeks; artists with
+        # many songs get traces for their longest-charting songs only
+        fig = trajectory_figure(
+            filtered_data,
+            title=f"Ranking Over Time for Songs by {selected_artist}",
+            labels=chart_queries.song_labels(selected_song_ids),
+        )
+        return fig
+
+    fig = memoize("artist_songs", (genre_key, performer_id), artist_figure)
 
-    # Manually set y-axis tick labels to replace 0 with 1
-    fig.update_yaxes(
-        tickvals=[1, 20, 40, 60, 80, 100],  # Adjust tick values as needed
-        ticktext=[1, 20, 40, 60, 80, 100],  # Replace 0 with 1 in tick labels
-    )
     # Display the chart using st.plotly_chart
-    st.plotly_chart(fig)
+    display_figure(fig)
+
+    # Show the artist's career statistics (all genres) from the ingest rollups
+    stats = chart_queries.artist_stats(performer_id)
+    st.caption(
+        f"Hits: {stats['songs']} | Top 10 hits: {stats['top10_hits']} | "
+        f"#1 hits: {stats['number_ones']} | Weeks on chart: {stats['weeks_on_chart']} | "
+        f"Weeks at #1: {stats['weeks_at_1']} | "
+        f"First week: {stats['debut_week']:%Y-%m-%d} | Last week: {stats['exit_week']:%Y-%m-%d}"
+    )
     ############################## LONGEST RANKING SONG  ####################################################
+    profile_run.section("longest_ranking")
     # Add an HTML anchor to link to this section
     st.markdown("<a name='songbyappearance'></a>", unsafe_allow_html=True)
 
     # Placeholder for Lineplot for Songs by Artist
     st.write("### Present The Longest-Ranking Songs")
 
-    date_list = filtered_songs_df.columns[2:]
-
     # Use select_date_range function with unique keys
-    selected_start_date, selected_end_date = select_date_range(date_list)
+    selected_start_date, selected_end_date = select_date_range(week_index)
+
+    # Choose what to count: any week on the chart, weeks in the top 10 or at #1
+    metric_labels = {label: metric for metric, (label, _) in RANGE_METRICS.items()}
+    metric_label = st.radio("Count weeks:", list(metric_labels), horizontal=True)
+    metric = metric_labels[metric_label]
 
     # Display the table
     display_longest_ranking_songs(
-        filtered_songs_df, selected_start_date, selected_end_date
+        filtered_songs,
+        selected_start_date,
+        selected_end_date,
+        metric,
+        genre_key,
     )
 
-    ###################################SIDEBAR FEATURES###########################################
-    # Display an image at the top of the sidebar
-    st.sidebar.image("Kozminski.png", width=100)
+    ################################# DOWNLOAD THE FILTERED CHARTS #################################
+    profile_run.section("export")
+    # Add an HTML anchor to link to this section
+    st.markdown("<a name='export'></a>", unsafe_allow_html=True)
 
-    # Add anchor links to the different plots in your app
-    st.sidebar.markdown(
-        """
-    ### Navigation
-    - [Top](#header)
-    - [Genre Selector](#genre_filter)
-    - [Charts](#charts)
-    - [One Song Rankings](#onesong)
-    - [Compare Song Rankings](#multisong)
-    - [Top Artists by # of Entries](#topartists)
-    - [All Songs by Artist](#allsongs)
-    - [Longest Ranking Song](#songbyappearance)
-    """
+    st.write("### Download the Charts")
+    st.caption(
+        f"Songs of the genre selection from {selected_start_date:%Y-%m-%d} "
+        f"to {selected_end_date:%Y-%m-%d} (the dates above)"
     )
-
-    # Display a text input for users to enter their email in the sidebar
-    user_email = st.sidebar.text_input(
-        "Enter your email to be notified when next year's charts are available:"
+    layout_labels = {
+        "Long (one row per song and week)": "long",
+        "Wide (one column per week)": "wide",
+    }
+    layout = layout_labels[st.radio("Layout:", list(layout_labels), horizontal=True)]
+    export_format = st.radio("Format:", ["CSV", "Parquet"], horizontal=True).lower()
+
+    # The API streams the file chunk by chunk as the browser downloads it, so
+    # the dashboard never holds it
+    st.link_button(
+        "Download",
+        export_url(
+            selected_start_date, selected_end_date, layout, export_format, genre_key
+        ),
     )
 
-    # Store the user's email in a file or database when submitted
-    if st.sidebar.button("Submit"):
-        if user_email:
-            # Save the email to a file, database, or send it to your backend for processing
-            with open("user_emails.txt", "a") as f:
-                f.write(user_email + "\n")
-            st.sidebar.success(
-                "Thank you! We'll notify you when next year's charts are available."
-            )
-        else:
-            st.sidebar.warning("Please enter a valid email address.")
-
-    # Add project description at the bottom of the sidebar with adjusted style
-    st.sidebar.markdown(
-        """
-    ---
-
-    <span style="font-size:smaller; opacity:0.75">
-    Created by Filip Sobota, Joanna Bańkowska, and Alon Benach
-    under the supervision of Jacek Mańko, Web Mining course, Kozmiński University 2023.
-    </span>
-    """,
-        unsafe_allow_html=True,
-    )
+    finish_rerun(profile_run)
 
 
 if __name__ == "__main__":
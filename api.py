@@ -0,0 +1,305 @@
+# %%
+# Headless JSON API over the chart data, for tools other than the dashboard
+# (which links to its streaming export for downloads).
+#
+#   python api.py [--port 8000]        serve the API (threaded dev server)
+#   python api.py --bench 5000         time the hot endpoints in-process
+#
+# Answers come from chart_queries (the same queries App.py uses). Serialized
+# responses are memoized per (path, query string) and invalidated when a
+# dataset reloads; their ETag is derived from the dataset versions and the
+# request, so a matching If-None-Match is answered with 304 before any work.
+# List endpoints take offset and limit parameters. /api/export streams the
+# filtered charts as CSV or Parquet (see chart_export.py).
+import argparse
+import hashlib
+import json
+import time
+
+import pandas as pd
+from flask import Flask, Response, jsonify, request
+
+import chart_queries
+from chart_export import EXPORT_FORMATS, EXPORT_LAYOUTS, export_chunks, export_file_name
+from chart_index import RANGE_METRICS
+from data_loader import SectionCache, dataset_cache, load_dataset
+from search_index import SEARCH_RESULTS
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+app = Flask(__name__)
+
+# Serialized responses, separate from the dashboard's section cache
+response_cache = SectionCache(dataset_cache, max_entries=4096)
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(error):
+    return jsonify({"error": error.message}), error.status
+
+
+# Function to turn a frame into JSON-ready records: dates as YYYY-MM-DD, NaN
+# and missing values as null
+def records(frame):
+    frame = frame.copy()
+    for column in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[column]):
+            frame[column] = frame[column].dt.strftime("%Y-%m-%d")
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict("records")
+
+
+# Function to read an integer query parameter
+def int_arg(name, default, minimum=0, maximum=None):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"{name} must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise ApiError(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+# Function to read a date query parameter
+def date_arg(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return parse_date(name, value)
+
+
+# Function to parse a date parameter; empty values and "NaT" are rejected
+def parse_date(name, value):
+    try:
+        date = pd.Timestamp(value)
+    except ValueError:
+        date = pd.NaT
+    if pd.isna(date):
+        raise ApiError(f"{name} must be a date (YYYY-MM-DD)")
+    return date
+
+
+# Function to resolve the genres and match parameters to song ids
+def genre_arg():
+    genres = [g for g in request.args.get("genres", "").split(",") if g]
+    unknown = set(genres) - set(load_dataset("genre_index").genres)
+    if unknown:
+        raise ApiError(f"Unknown genres: {', '.join(sorted(unknown))}")
+    match = request.args.get("match", "any")
+    if match not in ("any", "all"):
+        raise ApiError("match must be 'any' or 'all'")
+    return chart_queries.genre_song_ids(genres, match)
+
+
+# Function to page through a list of records with the offset/limit parameters
+def paginate(items):
+    offset = int_arg("offset", 0)
+    limit = int_arg("limit", DEFAULT_PAGE_SIZE, minimum=1, maximum=MAX_PAGE_SIZE)
+    page = items[offset : offset + limit]
+    return {
+        "total": len(items),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < len(items) else None,
+        "items": page,
+    }
+
+
+# Function to answer a request from the response cache, with ETag support
+def cached_response(compute):
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    # Pick up changed dataset files first, so the ETag reflects the current data
+    for name, _ in dataset_cache.source_versions():
+        load_dataset(name)
+    etag = hashlib.sha1(
+        repr((dataset_cache.source_versions(), key)).encode()
+    ).hexdigest()[:20]
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body = response_cache.get(
+            request.endpoint,
+            key,
+            lambda: json.dumps(compute(), separators=(",", ":")).encode(),
+        )
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.get("/api/weeks")
+def weeks():
+    return cached_response(
+        lambda: paginate(list(chart_queries.chart_weeks().strftime("%Y-%m-%d")))
+    )
+
+
+@app.get("/api/charts/<date>")
+def chart(date):
+    def compute():
+        week, entries = chart_queries.weekly_chart(
+            parse_date("date", date), genre_arg()
+        )
+        entries = entries[["rank", "song_id", "artist_id", "Artist", "Song"]]
+        return {"week": week.strftime("%Y-%m-%d"), **paginate(records(entries))}
+
+    return cached_response(compute)
+
+
+@app.get("/api/songs/<int:song_id>/trajectory")
+def song_trajectory(song_id):
+    songs = load_dataset("charts").songs
+    if song_id >= len(songs):
+        raise ApiError(f"Unknown song {song_id}", status=404)
+
+    def compute():
+        points = chart_queries.song_trajectory(song_id, gaps=False)
+        points = points.rename(columns={"Date": "week", "Rank": "rank"})
+        points["rank"] = points["rank"].astype("uint8")
+        return {
+            "song_id": song_id,
+            "Artist": songs.at[song_id, "Artist"],
+            "Song": songs.at[song_id, "Song"],
+            "stats": records(chart_queries.song_stats(song_id).to_frame().T)[0],
+            "points": records(points[["week", "rank"]]),
+        }
+
+    return cached_response(compute)
+
+
+@app.get("/api/artists/top")
+def top_artists():
+    def compute():
+        top = chart_queries.top_artists(genre_arg(), limit=None)
+        top = top.rename(columns={"Number of Appearances": "songs"})
+        top = top[top["songs"] > 0].reset_index()
+        return paginate(records(top))
+
+    return cached_response(compute)
+
+
+@app.get("/api/artists/<int:performer_id>/songs")
+def artist_songs(performer_id):
+    chart_store = load_dataset("charts")
+    if performer_id >= len(chart_store.performers):
+        raise ApiError(f"Unknown artist {performer_id}", status=404)
+
+    def compute():
+        song_ids = chart_queries.artist_song_ids(performer_id, genre_arg())
+        songs = chart_store.songs.loc[song_ids, ["artist_id", "Artist", "Song"]]
+        return {
+            "performer_id": performer_id,
+            "Artist": chart_store.performers.at[performer_id, "Artist"],
+            "stats": records(chart_queries.artist_stats(performer_id).to_frame().T)[0],
+            **paginate(records(songs.reset_index())),
+        }
+
+    return cached_response(compute)
+
+
+@app.get("/api/songs/longest")
+def longest_ranking():
+    def compute():
+        weeks = chart_queries.chart_weeks()
+        metric = request.args.get("metric", "weeks")
+        if metric not in RANGE_METRICS:
+            raise ApiError(f"metric must be one of {', '.join(RANGE_METRICS)}")
+        top = chart_queries.longest_ranking(
+            date_arg("start", weeks[0]),
+            date_arg("end", weeks[-1]),
+            metric,
+            song_ids=genre_arg(),
+            limit=int_arg("limit", 10, minimum=1, maximum=MAX_PAGE_SIZE),
+        )
+        return {"metric": metric, "items": records(top.reset_index())}
+
+    return cached_response(compute)
+
+
+@app.get("/api/search/songs")
+def search_songs():
+    def compute():
+        matches = chart_queries.search_songs(
+            request.args.get("q", ""),
+            genre_arg(),
+            limit=int_arg("limit", SEARCH_RESULTS, minimum=1, maximum=MAX_PAGE_SIZE),
+        )
+        return {"items": records(matches.reset_index())}
+
+    return cached_response(compute)
+
+
+@app.get("/api/search/artists")
+def search_artists():
+    def compute():
+        matches = chart_queries.search_artists(
+            request.args.get("q", ""),
+            limit=int_arg("limit", SEARCH_RESULTS, minimum=1, maximum=MAX_PAGE_SIZE),
+        )
+        return {"items": records(matches.reset_index())}
+
+    return cached_response(compute)
+
+
+@app.get("/api/export")
+def export():
+    # Streamed as it is written rather than cached: exports can be large
+    weeks = chart_queries.chart_weeks()
+    start = date_arg("start", weeks[0])
+    end = date_arg("end", weeks[-1])
+    layout = request.args.get("layout", "long")
+    if layout not in EXPORT_LAYOUTS:
+        raise ApiError(f"layout must be one of {', '.join(EXPORT_LAYOUTS)}")
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ApiError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    file_name = export_file_name(start, end, layout, fmt)
+    return Response(
+        export_chunks(start, end, genre_arg(), layout, fmt),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename={file_name}"},
+    )
+
+
+# Function to time the hot endpoints in-process with Flask's test client
+def bench(requests_per_endpoint):
+    client = app.test_client()
+    urls = [
+        "/api/charts/2005-06-12",
+        "/api/charts/2005-06-12?genres=rock",
+        "/api/songs/1234/trajectory",
+        "/api/artists/top?limit=100",
+        "/api/songs/longest?start=2000-01-01&end=2009-12-31",
+        "/api/search/songs?q=beautiful",
+    ]
+    for url in urls:
+        etag = client.get(url).headers["ETag"]
+        for headers in ({}, {"If-None-Match": etag}):
+            started = time.perf_counter()
+            for _ in range(requests_per_endpoint):
+                client.get(url, headers=headers)
+            rate = requests_per_endpoint / (time.perf_counter() - started)
+            kind = "304" if headers else "200"
+            print(f"{url} [{kind}]: {rate:,.0f} requests/s")
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSON API over the chart data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--bench", type=int, metavar="REQUESTS")
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,84 @@
+# %%
+# Normalized artist credits for chart songs.
+#
+# A Billboard credit such as "Calvin Harris Featuring Rihanna" or
+# "Dan + Shay & Justin Bieber" names several performers. Credits are parsed
+# once at ingest into a performer table (one row per trimmed name) and a
+# song <-> performer bridge table with a role: "lead" for the names before
+# "featuring"/"with", "featured" for the names after it.
+import re
+
+import numpy as np
+import pandas as pd
+
+# Separators that introduce featured performers
+FEATURE_PATTERN = re.compile(
+    r"\s+\(?(?:featuring|feat\.|duet with|with)\s+", flags=re.IGNORECASE
+)
+# Separators between any two performers of a credit
+SEPARATOR_PATTERN = re.compile(
+    r"\s+\(?(?:featuring|feat\.|duet with|with)\s+|,|&| and | x ", flags=re.IGNORECASE
+)
+
+ROLES = ["lead", "featured"]
+
+
+# Function to split credit strings into (artist_id, name, role) rows
+def split_credits(artists):
+    parts = artists["Artist"].str.split(FEATURE_PATTERN, n=1, expand=True, regex=True)
+    if parts.shape[1] == 1:
+        parts[1] = None
+
+    frames = []
+    for role, part in zip(ROLES, [parts[0], parts[1]]):
+        names = part.dropna().str.split(SEPARATOR_PATTERN)
+        names = names.explode()
+        frames.append(
+            pd.DataFrame(
+                {
+                    "artist_id": artists["artist_id"].to_numpy()[names.index],
+                    "Artist": names.to_numpy(),
+                    "role": role,
+                }
+            )
+        )
+    credits = pd.concat(frames, ignore_index=True)
+
+    # Trim names, collapse inner whitespace and drop the closing parenthesis
+    # left over from credits like "A (Featuring B)"; drop empty pieces
+    credits["Artist"] = (
+        credits["Artist"]
+        .str.replace(r"\s+", " ", regex=True)
+        .str.replace(r"^([^(]*)\)$", r"\1", regex=True)
+        .str.replace(r"\s*\($", "", regex=True)
+        .str.strip()
+    )
+    credits = credits[credits["Artist"] != ""]
+    # A name credited twice on the same song keeps its lead role
+    credits["role"] = pd.Categorical(credits["role"], categories=ROLES)
+    credits = credits.sort_values(["artist_id", "role"], kind="stable")
+    return credits.drop_duplicates(["artist_id", "Artist"], ignore_index=True)
+
+
+# Function to build the performer table and the song <-> performer bridge table
+# from the chart store's artist (credit) and song tables
+def build_credits(artists, songs):
+    credits = split_credits(artists.reset_index())
+
+    performer_codes, performer_names = pd.factorize(credits["Artist"])
+    performers = pd.DataFrame(
+        {
+            "performer_id": np.arange(len(performer_names), dtype="int32"),
+            "Artist": performer_names,
+        }
+    )
+    credits["performer_id"] = performer_codes.astype("int32")
+
+    # Every song inherits the performers of its credit string
+    song_credits = songs.reset_index()[["song_id", "artist_id"]].merge(
+        credits[["artist_id", "performer_id", "role"]], on="artist_id"
+    )
+    song_credits = song_credits[["song_id", "performer_id", "role"]]
+    return performers, song_credits.sort_values(
+        ["song_id", "role"], kind="stable", ignore_index=True
+    )
@@ -0,0 +1,257 @@
+# %%
+# Wikipedia genre enrichment for chart artists.
+#
+# Genres are looked up once per unique artist (not once per song) on a
+# bounded thread pool, and returned as one Artist -> Genre table that callers
+# join back onto their songs with a single merge.
+#
+# Only the infobox of an article is parsed: its <table> is cut out of the page
+# bytes and handed to lxml, instead of building a tree of the whole article.
+# The "Genres" cell is returned as a list of genres (one per list item, or per
+# comma or line break), without citation markers or inline styles.
+#
+#   python artist_genres.py --bench pages/     time the parsers over saved pages
+#   python artist_genres.py --reparse          re-parse the cached pages of the
+#                                              artists in genres.parquet
+import argparse
+import glob
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import lxml.html
+import pandas as pd
+import requests
+
+from http_cache import HTTP_CACHE_DIR, HttpCache, OfflineCacheMiss
+
+# The opening tag of the first infobox table, and any table tag inside it
+INFOBOX_START = re.compile(rb"<table[^>]*\bclass=\"[^\"]*\binfobox\b", re.I)
+TABLE_TAG = re.compile(rb"<(/?)table\b", re.I)
+# Pages handed to each worker process at a time
+PARSE_CHUNK_SIZE = 64
+
+# One requests.Session per worker thread (sessions are not thread-safe)
+_sessions = threading.local()
+
+
+def get_session():
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+# Function to generate Wikipedia URLs for artists
+def generate_wikipedia_urls(artist):
+    # Replace spaces with underscores and create Wikipedia URL
+    return f"https://en.wikipedia.org/wiki/{artist.replace(' ', '_')}"
+
+
+# Function to cut the first infobox table (with any nested tables) out of an
+# article's HTML, or None if the page has no infobox
+def infobox_html(content):
+    start = INFOBOX_START.search(content)
+    if start is None:
+        return None
+    depth = 0
+    for tag in TABLE_TAG.finditer(content, start.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return content[start.start() : content.index(b">", tag.end()) + 1]
+    return content[start.start() :]
+
+
+# Function to get the text of a list item without its nested lists
+def _item_text(item):
+    parts = [item.text or ""]
+    for child in item:
+        if child.tag not in ("ul", "ol"):
+            parts.append(child.text_content())
+        parts.append(child.tail or "")
+    return "".join(parts)
+
+
+# Function to split an infobox cell into clean, distinct items
+def _cell_items(cell):
+    # Citation markers and the inline styles of list templates are not text
+    for element in cell.xpath(".//sup | .//style | .//link"):
+        element.drop_tree()
+    items = [_item_text(item) for item in cell.iter("li")]
+    if not items:
+        for line_break in cell.iter("br"):
+            line_break.tail = "\n" + (line_break.tail or "")
+        items = re.split(r"[,;\n]", cell.text_content())
+    items = (re.sub(r"\[[^\]]*\]|\s+", " ", item).strip() for item in items)
+    return list(dict.fromkeys(item for item in items if item))
+
+
+# Function to parse the genres listed in an article's infobox (None when the
+# page has no infobox or no Genres row)
+def parse_infobox_genres(content):
+    fragment = infobox_html(content)
+    if fragment is None:
+        return None
+    table = lxml.html.fragment_fromstring(fragment.decode("utf-8", errors="replace"))
+    for row in table.iter("tr"):
+        header = row.find(".//th")
+        cell = row.find(".//td")
+        if header is not None and cell is not None:
+            if header.text_content().strip() == "Genres":
+                return _cell_items(cell) or None
+    return None
+
+
+# Function to parse the genres of a saved page (for worker processes)
+def parse_genre_file(path):
+    with open(path, "rb") as f:
+        return parse_infobox_genres(f.read())
+
+
+# Function to parse many saved pages on a process pool, in order
+def parse_genre_files(paths, workers=None):
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_genre_file, paths, chunksize=PARSE_CHUNK_SIZE))
+
+
+# Function to scrape artist's genres from Wikipedia, through the HTTP cache
+# when one is given
+def scrape_artist_genre(url, cache=None):
+    try:
+        # Set a timeout to prevent hanging
+        if cache is not None:
+            response = cache.get(url, get_session(), timeout=10)
+        else:
+            response = get_session().get(url, timeout=10)
+        if response.status_code == 200:
+            return parse_infobox_genres(response.content)
+        return None
+    except (requests.RequestException, OfflineCacheMiss) as e:
+        print(f"Request Exception: {e}")
+        return None
+
+
+# Function to build the Artist -> genres table: Genres holds the list of
+# genres and Genre the same items as one comma-separated text
+def artist_genre_table(artists, urls, genre_lists):
+    return pd.DataFrame(
+        {
+            "Artist": artists,
+            "Wikipedia_Page": urls,
+            "Genre": [
+                None if genres is None else ", ".join(genres) for genres in genre_lists
+            ],
+            "Genres": genre_lists,
+        }
+    )
+
+
+# Function to fetch the genre of every unique artist concurrently
+def fetch_artist_genres(artists, workers=8, progress_every=100, cache=None):
+    artists = pd.unique(pd.Series(artists).dropna())
+    urls = [generate_wikipedia_urls(artist) for artist in artists]
+    genres = {}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(scrape_artist_genre, url, cache): artist
+            for artist, url in zip(artists, urls)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            genres[futures[future]] = future.result()
+            if done % progress_every == 0 or done == len(futures):
+                elapsed = time.monotonic() - started
+                print(
+                    f"Genres fetched for {done}/{len(futures)} artists "
+                    f"({done / elapsed:.1f} artists/s)"
+                )
+
+    found = sum(genre is not None for genre in genres.values())
+    print(
+        f"Found genres for {found} of {len(artists)} artists "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    # Keep the artists in their original (first appearance) order
+    return artist_genre_table(artists, urls, [genres[artist] for artist in artists])
+
+
+# Function to re-parse the cached Wikipedia pages of many artists (e.g. after
+# a parsing fix) on a process pool, without any network access; artists whose
+# page is not cached are left out
+def reparse_artist_genres(artists, cache, workers=None):
+    artists = pd.unique(pd.Series(artists).dropna())
+    urls = [generate_wikipedia_urls(artist) for artist in artists]
+    started = time.monotonic()
+    paths = cache.body_paths(urls)
+    cached = [i for i, url in enumerate(urls) if url in paths]
+    genre_lists = parse_genre_files([paths[urls[i]] for i in cached], workers)
+    print(
+        f"Re-parsed {len(cached)} cached pages of {len(artists)} artists "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return artist_genre_table(artists[cached], [urls[i] for i in cached], genre_lists)
+
+
+# Function to time the full-page BeautifulSoup parse the scraper used to do
+# against the infobox parser, serially and on a process pool, over a
+# directory of saved pages
+def bench(corpus_dir, workers=None):
+    from bs4 import BeautifulSoup
+
+    def soup_genres(content):
+        soup = BeautifulSoup(content, "html.parser")
+        infobox = soup.find("table", {"class": "infobox"})
+        if infobox:
+            for row in infobox.find_all("tr"):
+                if row.th and row.th.text.strip() == "Genres":
+                    return row.td.text.strip()
+        return None
+
+    paths = sorted(glob.glob(os.path.join(corpus_dir, "*.html")))
+    pages = []
+    for path in paths:
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    print(f"{len(pages)} pages, {sum(map(len, pages)) / 1024**2:.1f} MB")
+
+    for label, parse in [
+        ("BeautifulSoup html.parser", lambda: [soup_genres(p) for p in pages]),
+        ("infobox + lxml", lambda: [parse_infobox_genres(p) for p in pages]),
+        ("infobox + lxml, process pool", lambda: parse_genre_files(paths, workers)),
+    ]:
+        started = time.perf_counter()
+        results = parse()
+        elapsed = time.perf_counter() - started
+        found = sum(result is not None for result in results)
+        print(
+            f"{label}: {elapsed:.2f}s ({len(pages) / elapsed:,.0f} pages/s), "
+            f"genres found on {found} pages"
+        )
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wikipedia genre parsing")
+    parser.add_argument("--bench", metavar="DIR", help="directory of saved pages")
+    parser.add_argument("--reparse", action="store_true")
+    parser.add_argument("--cache", default=HTTP_CACHE_DIR)
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+    if args.bench:
+        bench(args.bench, args.workers)
+    elif args.reparse:
+        from genre_tagger import GENRE_FILE, load_genre_tags, write_genre_tags
+
+        genre_df = load_genre_tags(GENRE_FILE, columns=("Artist", "Genre")).frame
+        cache = HttpCache(args.cache, offline=True)
+        reparsed = reparse_artist_genres(genre_df["Artist"], cache, args.workers)
+        # Artists without a cached page keep their stored genre text
+        reparsed = reparsed.set_index("Artist")["Genre"]
+        cached = genre_df["Artist"].isin(reparsed.index)
+        genre_df["Genre"] = genre_df["Genre"].where(
+            ~cached, genre_df["Artist"].map(reparsed)
+        )
+        write_genre_tags(genre_df, GENRE_FILE)
+        print(f"Re-tagged {GENRE_FILE}")
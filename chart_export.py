@@ -0,0 +1,159 @@
+# %%
+# Streaming export of a filtered chart view as CSV or Parquet.
+#
+# The view (songs of a genre selection, between two dates) is written chunk by
+# chunk and yielded as bytes, so neither the whole table nor the whole file is
+# ever held in memory. Two layouts:
+#   long   one row per (week, song): week, rank, song_id, Artist, Song
+#   wide   one row per song charting in the range: song_id, Artist, Song and
+#          one rank column per week of the range (empty when not charting)
+# Long chunks hold EXPORT_CHUNK_ROWS rows, wide chunks as many songs as fit in
+# EXPORT_CHUNK_CELLS cells. Chunks are Arrow tables written by Arrow's CSV and
+# Parquet writers; Parquet files get one row group per chunk.
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from data_loader import load_dataset
+
+EXPORT_CHUNK_ROWS = 50_000
+EXPORT_CHUNK_CELLS = 2_000_000
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+EXPORT_LAYOUTS = ("long", "wide")
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only file that keeps what was written until it is drained, so a
+    # writer's output can be yielded chunk by chunk
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# Function to get a file name for an export
+def export_file_name(start, end, layout="long", fmt="csv"):
+    return f"billboard-{layout}-{start:%Y-%m-%d}-{end:%Y-%m-%d}.{fmt}"
+
+
+# Function to get the Artist and Song names of every song id as Arrow arrays
+def _song_names():
+    songs = load_dataset("week_index").songs
+    return pa.array(songs["Artist"].astype(str)), pa.array(songs["Song"].astype(str))
+
+
+# Function to stream the chart rows of [start, end] as long-layout tables
+def _long_tables(start, end, song_ids, chunk_rows):
+    week_index = load_dataset("week_index")
+    start_pos, end_pos = load_dataset("range_index").week_range(start, end)
+    offsets = week_index.offsets
+    weeks = pa.array(week_index.weeks.date, pa.date32())
+    artists, songs = _song_names()
+    # Week position of every row in the range (rows are sorted by week, rank)
+    row_weeks = np.repeat(
+        np.arange(start_pos, end_pos), np.diff(offsets[start_pos : end_pos + 1])
+    )
+    first = offsets[start_pos]
+    for lo in range(0, len(row_weeks), chunk_rows):
+        chunk_weeks = row_weeks[lo : lo + chunk_rows]
+        rows = slice(first + lo, first + lo + len(chunk_weeks))
+        chunk_songs = week_index.song_ids[rows]
+        chunk_ranks = week_index.ranks[rows]
+        if song_ids is not None:
+            keep = np.isin(chunk_songs, song_ids)
+            chunk_weeks = chunk_weeks[keep]
+            chunk_songs = chunk_songs[keep]
+            chunk_ranks = chunk_ranks[keep]
+        yield pa.table(
+            {
+                "week": weeks.take(chunk_weeks),
+                "rank": pa.array(chunk_ranks, pa.uint8()),
+                "song_id": pa.array(chunk_songs, pa.int32()),
+                "Artist": artists.take(chunk_songs),
+                "Song": songs.take(chunk_songs),
+            }
+        )
+
+
+# Function to stream the songs charting in [start, end] as wide-layout tables,
+# with one rank column per week of the range only
+def _wide_tables(start, end, song_ids, chunk_cells):
+    week_index = load_dataset("week_index")
+    range_index = load_dataset("range_index")
+    start_pos, end_pos = range_index.week_range(start, end)
+    weeks = week_index.weeks[start_pos:end_pos]
+    candidates = range_index.song_ids if song_ids is None else np.sort(song_ids)
+    charting = candidates[range_index.counts(start, end, candidates) > 0]
+    artists, songs = _song_names()
+
+    rows = slice(week_index.offsets[start_pos], week_index.offsets[end_pos])
+    row_songs = week_index.song_ids[rows]
+    row_ranks = week_index.ranks[rows]
+    row_weeks = np.repeat(
+        np.arange(len(weeks)), np.diff(week_index.offsets[start_pos : end_pos + 1])
+    )
+    columns = list(weeks.strftime("%Y-%m-%d"))
+
+    songs_per_chunk = max(1, chunk_cells // max(len(weeks), 1))
+    for lo in range(0, len(charting), songs_per_chunk):
+        chunk_songs = charting[lo : lo + songs_per_chunk]
+        hits = np.isin(row_songs, chunk_songs)
+        matrix = np.zeros((len(weeks), len(chunk_songs)), dtype="uint8")
+        matrix[
+            row_weeks[hits], np.searchsorted(chunk_songs, row_songs[hits])
+        ] = row_ranks[hits]
+        table = {
+            "song_id": pa.array(chunk_songs, pa.int32()),
+            "Artist": artists.take(chunk_songs),
+            "Song": songs.take(chunk_songs),
+        }
+        # Weeks off the chart are nulls (empty in CSV)
+        for column, ranks in zip(columns, matrix):
+            table[column] = pa.array(ranks, pa.uint8(), mask=ranks == 0)
+        yield pa.table(table)
+
+
+# Function to stream the export of a filtered view as chunks of bytes
+def export_chunks(
+    start,
+    end,
+    song_ids=None,
+    layout="long",
+    fmt="csv",
+    chunk_rows=EXPORT_CHUNK_ROWS,
+    chunk_cells=EXPORT_CHUNK_CELLS,
+):
+    if layout == "long":
+        tables = _long_tables(start, end, song_ids, chunk_rows)
+    else:
+        tables = _wide_tables(start, end, song_ids, chunk_cells)
+    open_writer = pa_csv.CSVWriter if fmt == "csv" else pq.ParquetWriter
+
+    sink = _ChunkSink()
+    writer = None
+    for table in tables:
+        if writer is None:
+            writer = open_writer(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
@@ -0,0 +1,238 @@
+# %%
+# Concurrent fetcher for weekly Billboard charts.
+#
+# Weeks are fetched by a bounded thread pool. All workers share one token
+# bucket, so the request rate stays under the configured limit however many
+# workers run, and failed requests are retried with exponential backoff.
+# Results are handed to a callback as soon as each week is parsed, in
+# whatever order the weeks complete, and only a bounded window of weeks is in
+# flight at once.
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import billboard
+import pandas as pd
+import requests
+from bs4 import BeautifulSoup
+
+BILLBOARD_CHARTS_URL = "https://www.billboard.com/charts"
+
+# Status codes worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Entries of a complete chart page, for the charts whose size never changed.
+# Every page must list ranks 1..N without gaps; a page that does not, or that
+# has fewer entries than its chart's size, is broken or a placeholder and is
+# retried rather than stored
+CHART_SIZES = {"hot-100": 100, "billboard-200": 200}
+
+
+# Function to get the entries of a complete page of a chart (0 if unknown:
+# then only the ranks are checked)
+def chart_size(chart_name):
+    return CHART_SIZES.get(chart_name, 0)
+
+
+# Function to find why parsed entries are not a complete chart page (None if
+# they are): ranks must run 1..N, with at least min_entries of them
+def incomplete_chart(entries, min_entries=0):
+    ranks = [rank for _, _, rank in entries]
+    if not ranks:
+        return "no chart entries"
+    if ranks != list(range(1, len(ranks) + 1)):
+        return "chart ranks are not 1..N"
+    if len(ranks) < min_entries:
+        return f"only {len(ranks)} of {min_entries} chart entries"
+    return None
+
+
+# Function to list the chart week dates (Sundays) from start to end, inclusive
+def chart_weeks(start, end):
+    return pd.date_range(start, end, freq="W").strftime("%Y-%m-%d").tolist()
+
+
+class TokenBucket:
+    # Allows `rate` acquisitions per second on average, with bursts of up to
+    # `capacity`, shared by every thread that calls acquire()
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to block until a token is available, then take it
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryableError(Exception):
+    pass
+
+
+# One requests.Session per worker thread (sessions are not thread-safe)
+_sessions = threading.local()
+
+
+def get_session():
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+# Function to get the URL of a chart week's page
+def chart_url(chart_name, week, base_url=BILLBOARD_CHARTS_URL):
+    return f"{base_url}/{chart_name}/{week}"
+
+
+# Function to download the HTML page of one chart week, through the HTTP cache
+# when one is given; a rate limit token is taken only for network requests
+def fetch_chart_html(
+    chart_name,
+    week,
+    bucket,
+    base_url=BILLBOARD_CHARTS_URL,
+    timeout=25,
+    cache=None,
+):
+    url = chart_url(chart_name, week, base_url)
+    try:
+        if cache is not None:
+            response = cache.get(
+                url, get_session(), timeout, before_request=bucket.acquire
+            )
+        else:
+            bucket.acquire()
+            response = get_session().get(url, timeout=timeout)
+    except requests.RequestException as e:
+        raise RetryableError(f"{url}: {e}") from e
+    if response.status_code in RETRY_STATUS_CODES:
+        raise RetryableError(f"{url}: HTTP {response.status_code}")
+    if response.status_code == 404:
+        raise billboard.BillboardNotFoundException(f"Chart not found: {url}")
+    response.raise_for_status()
+    return response.text
+
+
+# Function to parse a chart page into (artist, song, rank) entries
+def parse_chart_html(chart_name, week, html):
+    # Reuse billboard.py's page parser on HTML we downloaded ourselves
+    chart = billboard.ChartData(chart_name, date=week, fetch=False)
+    chart._parsePage(BeautifulSoup(html, "html.parser"))
+    return [(entry.artist, entry.title, entry.rank) for entry in chart]
+
+
+# Function to fetch and parse one week, retrying with exponential backoff
+# (incomplete pages, see incomplete_chart, count as failed requests)
+def fetch_week(
+    chart_name,
+    week,
+    bucket,
+    base_url=BILLBOARD_CHARTS_URL,
+    max_retries=5,
+    backoff=1.0,
+    timeout=25,
+    cache=None,
+    min_entries=0,
+):
+    for attempt in range(max_retries + 1):
+        try:
+            html = fetch_chart_html(chart_name, week, bucket, base_url, timeout, cache)
+            entries = parse_chart_html(chart_name, week, html)
+            problem = incomplete_chart(entries, min_entries)
+            if problem is not None:
+                url = chart_url(chart_name, week, base_url)
+                if cache is not None:
+                    # Do not serve the incomplete page again
+                    cache.forget(url)
+                raise RetryableError(f"{url}: {problem}")
+            return entries
+        except RetryableError as e:
+            if attempt == max_retries:
+                raise
+            # Full jitter keeps retrying workers from hitting the server in sync
+            delay = random.uniform(0, backoff * 2**attempt)
+            print(f"Retrying {week} in {delay:.1f}s ({e})")
+            time.sleep(delay)
+
+
+# Function to fetch many weeks concurrently and pass each one to on_week.
+# At most `pending` weeks are queued or in flight at a time and each parsed
+# week is released once on_week returns, so memory stays bounded however many
+# weeks (or charts) a run covers.
+def fetch_weeks(
+    weeks,
+    on_week,
+    chart_name="hot-100",
+    workers=8,
+    rate=2.0,
+    burst=4,
+    base_url=BILLBOARD_CHARTS_URL,
+    max_retries=5,
+    backoff=1.0,
+    timeout=25,
+    cache=None,
+    pending=None,
+    min_entries=None,
+):
+    weeks = list(weeks)
+    pending = pending or workers * 2
+    if min_entries is None:
+        min_entries = chart_size(chart_name)
+    bucket = TokenBucket(rate, burst)
+    failed = {}
+    started = time.monotonic()
+    queued = iter(weeks)
+    futures = {}
+    done = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            for week in islice(queued, pending - len(futures)):
+                future = pool.submit(
+                    fetch_week,
+                    chart_name,
+                    week,
+                    bucket,
+                    base_url,
+                    max_retries,
+                    backoff,
+                    timeout,
+                    cache,
+                    min_entries,
+                )
+                futures[future] = week
+            if not futures:
+                break
+
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                week = futures.pop(future)
+                done += 1
+                try:
+                    on_week(week, future.result())
+                except Exception as e:
+                    failed[week] = e
+                    print(f"Failed to fetch {chart_name} for {week}: {e}")
+                    continue
+                print(f"Fetched {chart_name} for {week} ({done}/{len(weeks)})")
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Fetched {len(weeks) - len(failed)} weeks in {elapsed:.1f}s, "
+        f"{len(failed)} failed"
+    )
+    return failed
@@ -0,0 +1,109 @@
+# %%
+# Plotly figures of chart trajectories, built to a payload budget.
+#
+# Figures are serialized to JSON for the browser, so their size is the render
+# cost. Trajectories are trimmed to the visible date range, dates are sent as
+# YYYY-MM-DD strings and ranks as integers, only the songs with the most weeks
+# in view get a trace (and a legend entry) of their own, with the rest drawn
+# as one grey trace, and the date axis gets a bounded number of ticks. Above
+# WEBGL_POINTS points the traces are drawn with WebGL (scattergl).
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# Points above which traces are drawn with WebGL
+WEBGL_POINTS = 1000
+# Songs drawn as traces of their own; the rest share one trace
+MAX_TRACES = 20
+# Date axis ticks, at most
+MAX_TICKS = 12
+# Tick spacings tried in order until the ticks fit
+TICK_STEPS = ["7D", "14D", "28D", "MS", "2MS", "3MS", "6MS", "12MS", "24MS", "60MS"]
+RANK_TICKS = [1, 20, 40, 60, 80, 100]
+
+
+# Function to pick evenly spaced date ticks, at most max_ticks of them
+def bounded_ticks(start, end, max_ticks=MAX_TICKS):
+    for step in TICK_STEPS:
+        ticks = pd.date_range(start, end, freq=step)
+        if len(ticks) <= max_ticks:
+            break
+    return ticks
+
+
+# Function to get the x and y values of trajectory rows as compact lists; a
+# null point between songs (and at NaN ranks) keeps their lines apart
+def _trace_values(rows):
+    breaks = np.flatnonzero(np.diff(rows["song_id"].to_numpy())) + 1
+    dates = rows["Date"].dt.strftime("%Y-%m-%d").to_numpy(dtype=object)
+    ranks = rows["Rank"].to_numpy(dtype="float64")
+    ranks = np.where(np.isnan(ranks), None, np.nan_to_num(ranks).astype(int))
+    return (
+        np.insert(dates, breaks, None).tolist(),
+        np.insert(ranks.astype(object), breaks, None).tolist(),
+    )
+
+
+# Function to plot (song_id, Date, Rank) rows with the rank axis reversed.
+# labels maps song ids to legend names (None for a single unnamed line);
+# x_range limits the rows and the axis to a (start, end) pair of dates
+def trajectory_figure(
+    plot_data, title, labels=None, x_range=None, max_traces=MAX_TRACES
+):
+    if x_range is None:
+        x_range = (plot_data["Date"].min(), plot_data["Date"].max())
+    start, end = x_range
+    rows = plot_data[(plot_data["Date"] >= start) & (plot_data["Date"] <= end)]
+
+    # Songs with the most weeks in view first; the rest share one trace
+    weeks = rows.dropna(subset=["Rank"]).groupby("song_id", sort=False).size()
+    weeks = weeks.sort_values(ascending=False, kind="stable")
+    own = weeks.index[:max_traces]
+    groups = [(song_id, rows[rows["song_id"] == song_id]) for song_id in own]
+    rest = rows[~rows["song_id"].isin(own)]
+    if len(rest):
+        groups.append((None, rest.sort_values(["song_id", "Date"], kind="stable")))
+
+    trace = go.Scattergl if len(rows) > WEBGL_POINTS else go.Scatter
+    fig = go.Figure()
+    for song_id, group in groups:
+        x, y = _trace_values(group)
+        if song_id is None:
+            name = f"{len(weeks) - len(own)} other songs"
+            line = {"color": "lightgrey", "width": 1}
+        else:
+            name = None if labels is None else labels[song_id]
+            line = None
+        fig.add_trace(
+            trace(
+                x=x,
+                y=y,
+                mode="lines",
+                name=name,
+                line=line,
+                hovertemplate="%{x}<br>Rank %{y}",
+            )
+        )
+
+    ticks = bounded_ticks(start, end)
+    fig.update_layout(title=title, showlegend=labels is not None)
+    fig.update_xaxes(
+        range=[f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}"],
+        tickvals=list(ticks.strftime("%Y-%m-%d")),
+        tickformat="%Y-%m-%d",
+        tickangle=45,
+        title_text="Date",
+    )
+    fig.update_yaxes(
+        autorange="reversed",
+        tickvals=RANK_TICKS,
+        ticktext=RANK_TICKS,
+        title_text="Rank",
+    )
+    return fig
+
+
+# Function to measure a figure's serialized size in bytes, i.e. what is sent
+# to the browser
+def figure_size(fig):
+    return len(fig.to_json())
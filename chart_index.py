@@ -0,0 +1,206 @@
+# %%
+# Precomputed indexes over the chart store for the dashboard's week and range
+# queries.
+#
+# Weekly charts: the chart rows are stored as parallel (rank, song_id,
+# artist_id) arrays ordered by (week, rank), with the start offset of every
+# week, so one week's chart is a single contiguous slice. Dates resolve to the
+# nearest stored week with one binary search over the sorted week index.
+#
+# Song trajectories: each song's chart history is stored run-length encoded,
+# as runs of consecutive chart weeks (start week, uint8 ranks of the run) in
+# flat arrays with per-song offsets, so any set of songs expands into one
+# long plotting frame with a few vectorized gathers.
+#
+# Weeks-on-chart counts: every chart row is encoded as song_id * n_weeks +
+# week position and the codes are sorted. Within one song's block of codes the
+# position in the array is the song's cumulative number of charted weeks, so
+# the weeks a song charted in [start, end] is the difference of two binary
+# searches, and all songs are answered at once by vectorized searchsorted
+# calls. The same layout restricted to ranks 1-10 and to rank 1 answers
+# "weeks in the top 10" and "weeks at #1".
+import numpy as np
+import pandas as pd
+
+# Range metrics: name -> (label, highest rank counted)
+RANGE_METRICS = {
+    "weeks": ("Weeks on chart", 100),
+    "top10": ("Weeks in the top 10", 10),
+    "number1": ("Weeks at #1", 1),
+}
+
+
+# Function to expand (start, length) ranges into one array of positions
+def expand_ranges(starts, lengths):
+    ends = np.cumsum(lengths)
+    return np.repeat(starts - ends + lengths, lengths) + np.arange(
+        ends[-1] if len(ends) else 0
+    )
+
+
+class SongTrajectories:
+    def __init__(self, chart_store):
+        self.weeks = chart_store.weeks
+
+        chart = chart_store.chart
+        song_ids = chart["song_id"].to_numpy()
+        week_pos = self.weeks.get_indexer(chart["week"]).astype("int32")
+        order = np.lexsort((week_pos, song_ids))
+        song_ids, week_pos = song_ids[order], week_pos[order]
+        # Ranks of every song's charted weeks, run after run
+        self.ranks = chart["rank"].to_numpy().astype("uint8")[order]
+
+        # A run starts at a song's first week and after every gap in its weeks
+        breaks = np.ones(len(order), dtype=bool)
+        breaks[1:] = (song_ids[1:] != song_ids[:-1]) | (
+            week_pos[1:] != week_pos[:-1] + 1
+        )
+        self.run_offsets = np.flatnonzero(breaks)
+        self.run_lengths = np.diff(np.append(self.run_offsets, len(order)))
+        self.run_weeks = week_pos[self.run_offsets]
+        # Runs of song i are song_runs[i]:song_runs[i + 1]
+        run_songs = song_ids[self.run_offsets]
+        self.song_runs = np.searchsorted(
+            run_songs, np.arange(len(chart_store.songs) + 1)
+        )
+
+    # Function to get the ranks of the given songs as one long frame
+    # (song_id, Date, Rank) ordered by song then date. With gaps=True a NaN rank
+    # is inserted after each run that a later run of the same song follows, so
+    # plotted lines break where the song left the chart.
+    def frame(self, song_ids, gaps=True):
+        song_ids = np.asarray(song_ids, dtype="int64")
+        first, last = self.song_runs[song_ids], self.song_runs[song_ids + 1]
+        runs = expand_ranges(first, last - first)
+        run_song = np.repeat(np.arange(len(song_ids)), last - first)
+        lengths = self.run_lengths[runs]
+
+        rows = expand_ranges(self.run_offsets[runs], lengths)
+        song_pos = np.repeat(run_song, lengths)
+        week_pos = expand_ranges(self.run_weeks[runs], lengths)
+        ranks = self.ranks[rows].astype("float32")
+
+        if gaps:
+            # Runs followed by another run of the same song
+            inner = np.flatnonzero(run_song[1:] == run_song[:-1])
+            song_pos = np.concatenate([song_pos, run_song[inner]])
+            week_pos = np.concatenate(
+                [week_pos, self.run_weeks[runs[inner]] + lengths[inner]]
+            )
+            ranks = np.concatenate([ranks, np.full(len(inner), np.nan, "float32")])
+            order = np.lexsort((week_pos, song_pos))
+            song_pos, week_pos, ranks = song_pos[order], week_pos[order], ranks[order]
+
+        return pd.DataFrame(
+            {
+                "song_id": song_ids[song_pos],
+                "Date": self.weeks[week_pos],
+                "Rank": ranks,
+            }
+        )
+
+
+class ChartRangeIndex:
+    def __init__(self, chart_store):
+        self.weeks = chart_store.weeks
+        self.n_weeks = len(self.weeks)
+        self.song_ids = chart_store.songs.index.to_numpy()
+
+        chart = chart_store.chart
+        week_pos = self.weeks.get_indexer(chart["week"]).astype("int64")
+        codes = chart["song_id"].to_numpy().astype("int64") * self.n_weeks + week_pos
+        ranks = chart["rank"].to_numpy()
+
+        # Sorted (song, week) codes per metric
+        self.codes = {
+            metric: np.sort(codes[ranks <= max_rank])
+            for metric, (_, max_rank) in RANGE_METRICS.items()
+        }
+
+    # Function to turn a date range into a half-open range of week positions
+    def week_range(self, start, end):
+        start_pos = self.weeks.searchsorted(np.datetime64(start, "ns"), side="left")
+        end_pos = self.weeks.searchsorted(np.datetime64(end, "ns"), side="right")
+        return start_pos, end_pos
+
+    # Function to count, for every song, the weeks in [start, end] on the metric
+    def counts(self, start, end, song_ids=None, metric="weeks"):
+        song_ids = self.song_ids if song_ids is None else np.asarray(song_ids)
+        start_pos, end_pos = self.week_range(start, end)
+        base = song_ids.astype("int64") * self.n_weeks
+        codes = self.codes[metric]
+        return np.searchsorted(codes, base + end_pos) - np.searchsorted(
+            codes, base + start_pos
+        )
+
+    # Function to get the k songs with the most weeks in [start, end]
+    def top(self, start, end, k=10, song_ids=None, metric="weeks"):
+        song_ids = self.song_ids if song_ids is None else np.asarray(song_ids)
+        counts = self.counts(start, end, song_ids, metric)
+        k = min(k, len(counts))
+        if k == 0:
+            return song_ids[:0], counts[:0]
+        best = np.argpartition(-counts, k - 1)[:k]
+        best = best[np.argsort(-counts[best], kind="stable")]
+        best = best[counts[best] > 0]
+        return song_ids[best], counts[best]
+
+
+class WeekIndex:
+    def __init__(self, chart_store):
+        self.weeks = chart_store.weeks
+        self.songs = chart_store.songs[["Artist", "Song"]]
+
+        chart = chart_store.chart
+        week_pos = self.weeks.get_indexer(chart["week"])
+        order = np.lexsort((chart["rank"].to_numpy(), week_pos))
+        self.ranks = chart["rank"].to_numpy()[order]
+        self.song_ids = chart["song_id"].to_numpy()[order]
+        self.artist_ids = chart["artist_id"].to_numpy()[order]
+        # Rows of week i are offsets[i]:offsets[i + 1]
+        self.offsets = np.searchsorted(week_pos[order], np.arange(len(self.weeks) + 1))
+
+    # Function to resolve a date to the latest stored week on or before it
+    # (the first stored week for earlier dates)
+    def resolve(self, date):
+        pos = self.weeks.searchsorted(pd.Timestamp(date), side="right") - 1
+        return self.weeks[max(pos, 0)]
+
+    # Function to get the row slice of a date's chart week
+    def week_slice(self, date):
+        pos = self.weeks.get_loc(self.resolve(date))
+        return slice(self.offsets[pos], self.offsets[pos + 1])
+
+    # Function to get the chart of a week ordered by rank, optionally only for
+    # the given songs
+    def week(self, date, song_ids=None):
+        rows = self.week_slice(date)
+        chart = pd.DataFrame(
+            {
+                "rank": self.ranks[rows],
+                "song_id": self.song_ids[rows],
+                "artist_id": self.artist_ids[rows],
+            }
+        )
+        if song_ids is not None:
+            chart = chart[np.isin(chart["song_id"].to_numpy(), song_ids)]
+        return chart.join(self.songs, on="song_id")
+
+    # Function to compare the charts of two weeks: songs new in the second week,
+    # songs that dropped out after the first, and songs whose rank changed
+    def diff(self, date_a, date_b, song_ids=None):
+        chart_a = self.week(date_a, song_ids)
+        chart_b = self.week(date_b, song_ids)
+        both = chart_b.merge(
+            chart_a[["song_id", "rank"]], on="song_id", suffixes=("", "_before")
+        )
+        both["change"] = both["rank_before"].astype("int16") - both["rank"].astype(
+            "int16"
+        )
+        return {
+            "new": chart_b[~chart_b["song_id"].isin(chart_a["song_id"])],
+            "dropped": chart_a[~chart_a["song_id"].isin(chart_b["song_id"])],
+            "moved": both[both["change"] != 0].sort_values(
+                "change", ascending=False, key=abs, kind="stable"
+            ),
+        }
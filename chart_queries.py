@@ -0,0 +1,111 @@
+# %%
+# Query engine for the chart data, shared by App.py and the JSON API (api.py).
+#
+# Every query reads the process-wide datasets and indexes from data_loader, so
+# answers come from the precomputed week, trajectory, range and credit indexes
+# rather than from scans of the chart rows. Results are DataFrames; callers
+# render or serialize them.
+import numpy as np
+import pandas as pd
+
+from data_loader import load_dataset
+from search_index import SEARCH_RESULTS
+
+
+# Function to get the ids of the songs matching a genre selection (None when
+# no genre is selected, meaning every song)
+def genre_song_ids(genres, match="any"):
+    if not genres:
+        return None
+    return load_dataset("genre_index").song_ids_for(genres, match)
+
+
+# Function to list every stored chart week
+def chart_weeks():
+    return load_dataset("week_index").weeks
+
+
+# Function to get the chart of the week on or before a date, ordered by rank
+def weekly_chart(date, song_ids=None):
+    week_index = load_dataset("week_index")
+    week = week_index.resolve(date)
+    return week, week_index.week(week, song_ids)
+
+
+# Function to get a song's weekly ranks (NaN rows mark gaps between runs)
+def song_trajectory(song_id, gaps=True):
+    return load_dataset("song_trajectories").frame([song_id], gaps=gaps)
+
+
+# Function to get a song's rollups: weeks on chart, peak, weeks in the top 10
+# and at #1, debut and exit week
+def song_stats(song_id):
+    return load_dataset("charts").song_stats.loc[song_id]
+
+
+# Function to get a performer's rollups over all their songs: distinct hits,
+# top 10 hits, #1 hits, weeks on chart and at #1, peak, debut and exit week
+def artist_stats(performer_id):
+    return load_dataset("charts").performer_stats.loc[performer_id]
+
+
+# Function to count the songs credited to each performer, most songs first
+# (every performer when limit is None)
+def top_artists(song_ids=None, limit=100):
+    chart_store = load_dataset("charts")
+    if song_ids is None:
+        # Every song counts: read the materialized per-performer rollups
+        song_counts = chart_store.performer_stats["songs"].reindex(
+            chart_store.performers.index, fill_value=0
+        )
+    else:
+        song_counts = chart_store.performer_song_counts(song_ids)
+    top = pd.DataFrame(
+        {
+            "Artist": chart_store.performers["Artist"],
+            "Number of Appearances": song_counts,
+        }
+    )
+    return top.nlargest(limit or len(top), "Number of Appearances")
+
+
+# Function to get the ids of a performer's songs, optionally among given songs
+def artist_song_ids(performer_id, song_ids=None):
+    performer_song_ids = load_dataset("charts").performer_song_ids(performer_id)
+    if song_ids is None:
+        return performer_song_ids
+    return np.intersect1d(performer_song_ids, song_ids)
+
+
+# Function to get the songs with the most weeks (on the chart, in the top 10
+# or at #1) between two dates
+def longest_ranking(start, end, metric="weeks", song_ids=None, limit=10):
+    songs = load_dataset("charts").songs
+    top_ids, counts = load_dataset("range_index").top(
+        start, end, k=limit, song_ids=song_ids, metric=metric
+    )
+    top = songs.loc[top_ids, ["Artist", "Song"]]
+    top["Count"] = counts
+    return top
+
+
+# Function to label songs "Song — Artist", so that equal titles by different
+# artists stand apart
+def song_labels(song_ids):
+    songs = load_dataset("charts").songs.loc[song_ids, ["Artist", "Song"]]
+    return songs["Song"].astype(str) + " — " + songs["Artist"].astype(str)
+
+
+# Function to find songs by the start of any word of their title or artist
+# (or by a close spelling), best and most popular matches first
+def search_songs(query, song_ids=None, limit=SEARCH_RESULTS):
+    ids = load_dataset("song_search").search(query, limit, song_ids)
+    matches = load_dataset("charts").songs.loc[ids, ["Artist", "Song"]].astype(str)
+    matches["label"] = song_labels(ids)
+    return matches
+
+
+# Function to find performers by name, best and most popular matches first
+def search_artists(query, performer_ids=None, limit=SEARCH_RESULTS):
+    ids = load_dataset("artist_search").search(query, limit, performer_ids)
+    return load_dataset("charts").performers.loc[ids, ["Artist"]]
@@ -0,0 +1,144 @@
+# %%
+# Per-song and per-performer chart statistics, materialized at ingest.
+#
+# song_stats.parquet holds one row per song (weeks on chart, peak position,
+# weeks in the top 10 and at #1, debut and exit week). performer_stats.parquet
+# rolls those up per performer, adding the number of distinct hits, top 10
+# hits and #1 hits. Both live in the chart store directory. The weeks the
+# song rollups cover are kept in the file metadata, so newly appended weeks
+# are folded into the existing rollups without rereading the whole history.
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SONG_STATS_FILE = "song_stats.parquet"
+PERFORMER_STATS_FILE = "performer_stats.parquet"
+
+SONG_STATS_SCHEMA = pa.schema(
+    [
+        ("song_id", pa.int32()),
+        ("weeks_on_chart", pa.int32()),
+        ("peak", pa.uint8()),
+        ("weeks_top10", pa.int32()),
+        ("weeks_at_1", pa.int32()),
+        ("debut_week", pa.date32()),
+        ("exit_week", pa.date32()),
+    ]
+)
+PERFORMER_STATS_SCHEMA = pa.schema(
+    [
+        ("performer_id", pa.int32()),
+        ("songs", pa.int32()),
+        ("top10_hits", pa.int32()),
+        ("number_ones", pa.int32()),
+        ("weeks_on_chart", pa.int32()),
+        ("weeks_at_1", pa.int32()),
+        ("peak", pa.uint8()),
+        ("debut_week", pa.date32()),
+        ("exit_week", pa.date32()),
+    ]
+)
+
+# How each song statistic combines when two sets of weeks are merged
+SONG_STATS_MERGE = {
+    "weeks_on_chart": "sum",
+    "peak": "min",
+    "weeks_top10": "sum",
+    "weeks_at_1": "sum",
+    "debut_week": "min",
+    "exit_week": "max",
+}
+
+
+# Function to compute the song rollups of long chart rows (song_id, week, rank)
+def song_rollups(chart):
+    rank = chart["rank"].to_numpy()
+    rows = pd.DataFrame(
+        {
+            "song_id": chart["song_id"].to_numpy(),
+            "week": chart["week"].to_numpy(),
+            "rank": rank,
+            "top10": rank <= 10,
+            "number1": rank == 1,
+        }
+    )
+    stats = rows.groupby("song_id").agg(
+        weeks_on_chart=("rank", "size"),
+        peak=("rank", "min"),
+        weeks_top10=("top10", "sum"),
+        weeks_at_1=("number1", "sum"),
+        debut_week=("week", "min"),
+        exit_week=("week", "max"),
+    )
+    return stats.astype({"weeks_top10": "int32", "weeks_at_1": "int32"})
+
+
+# Function to fold the rollups of newly added weeks into existing rollups
+def merge_song_rollups(song_stats, new_stats):
+    stats = pd.concat([song_stats, new_stats])
+    return stats.groupby(level="song_id").agg(SONG_STATS_MERGE)
+
+
+# Function to roll song statistics up to performers through the credits
+def performer_rollups(song_stats, credits):
+    # Songs without chart rows have no stats and are left out
+    rows = credits[["song_id", "performer_id"]].join(
+        song_stats, on="song_id", how="inner"
+    )
+    rows["top10_hit"] = rows["peak"] <= 10
+    rows["number_one"] = rows["peak"] == 1
+    return rows.groupby("performer_id").agg(
+        songs=("song_id", "size"),
+        top10_hits=("top10_hit", "sum"),
+        number_ones=("number_one", "sum"),
+        weeks_on_chart=("weeks_on_chart", "sum"),
+        weeks_at_1=("weeks_at_1", "sum"),
+        peak=("peak", "min"),
+        debut_week=("debut_week", "min"),
+        exit_week=("exit_week", "max"),
+    )
+
+
+# Function to write both rollup tables, recording the weeks they cover
+def write_rollups(root, song_stats, performer_stats, weeks):
+    metadata = {
+        b"weeks": json.dumps(sorted(f"{week:%Y-%m-%d}" for week in weeks)).encode()
+    }
+    for stats, schema, name in [
+        (song_stats, SONG_STATS_SCHEMA, SONG_STATS_FILE),
+        (performer_stats, PERFORMER_STATS_SCHEMA, PERFORMER_STATS_FILE),
+    ]:
+        table = pa.Table.from_pandas(
+            stats.reset_index(), schema=schema, preserve_index=False
+        )
+        path = os.path.join(root, name)
+        pq.write_table(table.replace_schema_metadata(metadata), path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+
+# Function to read the rollups and the set of weeks they cover (None if the
+# store has no rollups yet)
+def read_rollups(root):
+    song_file = os.path.join(root, SONG_STATS_FILE)
+    performer_file = os.path.join(root, PERFORMER_STATS_FILE)
+    if not (os.path.exists(song_file) and os.path.exists(performer_file)):
+        return None
+    song_stats = pq.read_table(song_file, memory_map=True)
+    weeks = set(pd.to_datetime(json.loads(song_stats.schema.metadata[b"weeks"])))
+    performer_stats = pq.read_table(performer_file, memory_map=True)
+    return (
+        song_stats.to_pandas(date_as_object=False).set_index("song_id"),
+        performer_stats.to_pandas(date_as_object=False).set_index("performer_id"),
+        weeks,
+    )
+
+
+# Function to delete the rollups, e.g. when a week they cover is rewritten
+def remove_rollups(root):
+    for name in (SONG_STATS_FILE, PERFORMER_STATS_FILE):
+        path = os.path.join(root, name)
+        if os.path.exists(path):
+            os.remove(path)
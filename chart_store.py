@@ -0,0 +1,508 @@
+# %%
+# Columnar long-format store for the weekly Billboard charts.
+#
+# Layout of a store directory:
+#   artists.parquet                     artist_id, Artist
+#   songs.parquet                       song_id, artist_id, Song
+#   performers.parquet                  performer_id, Artist (one parsed name)
+#   credits.parquet                     song_id, performer_id, role (lead/featured)
+#   song_stats.parquet                  per-song rollups (see chart_rollups.py)
+#   performer_stats.parquet             per-performer rollups
+#   weeks/year=YYYY/part-0.parquet      song_id, artist_id, week, rank
+#   weeks/year=YYYY/week-YYYY-MM-DD.parquet   weeks appended since the last compaction
+#
+# One row per (song, week) the song was on the chart, so the data grows by
+# about 100 rows per week instead of one column per week, and the yearly
+# partitions are opened with memory mapping.
+import glob
+import os
+import shutil
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from artist_credits import ROLES, build_credits
+from chart_rollups import (
+    merge_song_rollups,
+    performer_rollups,
+    read_rollups,
+    remove_rollups,
+    song_rollups,
+    write_rollups,
+)
+
+CHART_STORE_DIR = "chart_store"
+DEFAULT_CHART = "hot-100"
+
+CHART_SCHEMA = pa.schema(
+    [
+        ("song_id", pa.int32()),
+        ("artist_id", pa.int32()),
+        ("week", pa.date32()),
+        ("rank", pa.uint8()),
+    ]
+)
+SONGS_SCHEMA = pa.schema(
+    [("song_id", pa.int32()), ("artist_id", pa.int32()), ("Song", pa.string())]
+)
+ARTISTS_SCHEMA = pa.schema([("artist_id", pa.int32()), ("Artist", pa.string())])
+PERFORMERS_SCHEMA = pa.schema([("performer_id", pa.int32()), ("Artist", pa.string())])
+CREDITS_SCHEMA = pa.schema(
+    [("song_id", pa.int32()), ("performer_id", pa.int32()), ("role", pa.string())]
+)
+
+
+# Function to get the store directory of a Billboard chart; the Hot 100 keeps
+# the plain chart_store directory the app reads
+def chart_store_dir(chart_name=DEFAULT_CHART, root=CHART_STORE_DIR):
+    if chart_name == DEFAULT_CHART:
+        return root
+    return f"{root}-{chart_name}"
+
+
+# Function to turn the legacy wide songs_df (one column per week) into long rows
+def long_from_wide(songs_df):
+    long_df = songs_df.melt(
+        id_vars=["Artist", "Song"], var_name="week", value_name="rank"
+    )
+    long_df = long_df.dropna(subset=["rank"])
+    long_df["week"] = pd.to_datetime(long_df["week"])
+    long_df["rank"] = long_df["rank"].astype("uint8")
+    return long_df.reset_index(drop=True)
+
+
+# Function to assign integer ids to artists and songs in order of first appearance
+def assign_ids(chart_df):
+    # Sorting by week and rank reproduces the row order of the old wide sheet
+    chart_df = chart_df.sort_values(["week", "rank"], kind="stable")
+
+    artist_codes, artist_names = pd.factorize(chart_df["Artist"])
+    song_codes, song_keys = pd.factorize(
+        pd.MultiIndex.from_arrays([chart_df["Artist"], chart_df["Song"]])
+    )
+
+    artists = pd.DataFrame(
+        {
+            "artist_id": np.arange(len(artist_names), dtype="int32"),
+            "Artist": artist_names,
+        }
+    )
+    song_artists = song_keys.get_level_values(0)
+    songs = pd.DataFrame(
+        {
+            "song_id": np.arange(len(song_keys), dtype="int32"),
+            "artist_id": artist_names.get_indexer(song_artists).astype("int32"),
+            "Song": song_keys.get_level_values(1),
+        }
+    )
+    chart = pd.DataFrame(
+        {
+            "song_id": song_codes.astype("int32"),
+            "artist_id": artist_codes.astype("int32"),
+            "week": chart_df["week"].values,
+            "rank": chart_df["rank"].values.astype("uint8"),
+        }
+    )
+    return chart, songs, artists
+
+
+# Function to write a full chart history (Artist, Song, week, rank) as a store
+def write_chart_store(chart_df, root=CHART_STORE_DIR):
+    chart, songs, artists = assign_ids(chart_df)
+
+    # Build the new store next to the old one and swap it in at the end
+    staging = root + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    pq.write_table(
+        pa.Table.from_pandas(artists, schema=ARTISTS_SCHEMA, preserve_index=False),
+        os.path.join(staging, "artists.parquet"),
+    )
+    pq.write_table(
+        pa.Table.from_pandas(songs, schema=SONGS_SCHEMA, preserve_index=False),
+        os.path.join(staging, "songs.parquet"),
+    )
+    _, credits = write_credits(staging, artists, songs)
+    song_stats = song_rollups(chart)
+    write_rollups(
+        staging,
+        song_stats,
+        performer_rollups(song_stats, credits),
+        set(chart["week"]),
+    )
+    for year, year_rows in chart.groupby(chart["week"].dt.year):
+        partition = os.path.join(staging, "weeks", f"year={year}")
+        os.makedirs(partition)
+        pq.write_table(
+            pa.Table.from_pandas(year_rows, schema=CHART_SCHEMA, preserve_index=False),
+            os.path.join(partition, "part-0.parquet"),
+        )
+
+    if os.path.exists(root):
+        shutil.move(root, root + ".old")
+    os.replace(staging, root)
+    shutil.rmtree(root + ".old", ignore_errors=True)
+
+
+# Function to read one Parquet file through a memory map
+def read_parquet_mapped(path, schema=None, columns=None):
+    return pq.read_table(path, schema=schema, columns=columns, memory_map=True)
+
+
+# Function to write a Parquet file so readers never see a half-written file
+def write_parquet_atomic(table, path):
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+# Function to parse the artist credits of a store into its credit tables
+def write_credits(root, artists, songs):
+    performers, credits = build_credits(artists, songs)
+    credits["role"] = credits["role"].astype(str)
+    write_parquet_atomic(
+        pa.Table.from_pandas(
+            performers, schema=PERFORMERS_SCHEMA, preserve_index=False
+        ),
+        os.path.join(root, "performers.parquet"),
+    )
+    write_parquet_atomic(
+        pa.Table.from_pandas(credits, schema=CREDITS_SCHEMA, preserve_index=False),
+        os.path.join(root, "credits.parquet"),
+    )
+    return performers, credits
+
+
+# Function to list the Parquet files of one year partition (or all of them)
+def partition_files(root, year="*"):
+    return sorted(glob.glob(os.path.join(root, "weeks", f"year={year}", "*.parquet")))
+
+
+# Function to read the chart rows of partition files. Compaction writes the
+# merged part file before it removes the week files, so a reader in between
+# (or after a crash) sees those weeks twice: each week is read from the first
+# file holding it only, part-0 sorting before the week files.
+def read_partition_files(paths):
+    tables = []
+    seen = set()
+    for path in paths:
+        table = read_parquet_mapped(path, schema=CHART_SCHEMA)
+        weeks = set(pc.unique(table.column("week")).to_pylist())
+        if weeks & seen:
+            repeated = pa.array(sorted(weeks & seen), pa.date32())
+            table = table.filter(
+                pc.invert(pc.is_in(table.column("week"), value_set=repeated))
+            )
+        seen |= weeks
+        tables.append(table)
+    return pa.concat_tables(tables) if tables else CHART_SCHEMA.empty_table()
+
+
+# Function to read the chart rows of the given weeks, opening only the
+# partitions of their years
+def read_weeks(root, weeks):
+    dates = pa.array([week.date() for week in weeks], pa.date32())
+    table = read_partition_files(
+        [
+            path
+            for year in sorted({week.year for week in weeks})
+            for path in partition_files(root, year)
+        ]
+    )
+    table = table.filter(pc.is_in(table.column("week"), value_set=dates))
+    return table.to_pandas(date_as_object=False)
+
+
+class ChartStoreWriter:
+    # Appends weekly charts to a store one week at a time. Every week is
+    # written to its own file as soon as it is fetched, so an interrupted run
+    # keeps everything fetched so far and a restart skips the stored weeks.
+    def __init__(self, root=CHART_STORE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "weeks"), exist_ok=True)
+
+        self.artist_ids = {}
+        self.song_ids = {}
+        self.songs = []
+        self.artists = []
+        if os.path.exists(os.path.join(root, "songs.parquet")):
+            artists = read_parquet_mapped(os.path.join(root, "artists.parquet"))
+            songs = read_parquet_mapped(os.path.join(root, "songs.parquet"))
+            self.artists = artists.column("Artist").to_pylist()
+            names = self.artists
+            self.songs = list(
+                zip(
+                    songs.column("artist_id").to_pylist(),
+                    songs.column("Song").to_pylist(),
+                )
+            )
+            self.artist_ids = {name: idx for idx, name in enumerate(names)}
+            self.song_ids = {
+                (names[artist_id], song): idx
+                for idx, (artist_id, song) in enumerate(self.songs)
+            }
+
+        # Every week already present in the store
+        self.stored_weeks = set()
+        for path in partition_files(root):
+            weeks = read_parquet_mapped(path, columns=["week"]).column("week")
+            self.stored_weeks.update(pd.to_datetime(pc.unique(weeks).to_pandas()))
+
+    # Function to check whether a week is already stored
+    def has_week(self, week):
+        return pd.Timestamp(week) in self.stored_weeks
+
+    # Function to store one week's chart given as (artist, song, rank) entries
+    def append_week(self, week, entries):
+        week = pd.Timestamp(week)
+        with self._lock:
+            if week in self.stored_weeks:
+                # Refetched week: drop the stored copy before writing the new one
+                self._drop_week(week)
+
+            known_artists = len(self.artists)
+            known_songs = len(self.songs)
+            song_ids, artist_ids, ranks = [], [], []
+            for artist, song, rank in entries:
+                artist_ids.append(self._artist_id(artist))
+                song_ids.append(self._song_id(artist, song))
+                ranks.append(rank)
+
+            # Dimensions go first: a crash between the two writes only leaves
+            # unused ids behind, never chart rows pointing at unknown songs
+            if len(self.artists) > known_artists or len(self.songs) > known_songs:
+                self._write_dimensions()
+
+            table = pa.Table.from_pydict(
+                {
+                    "song_id": song_ids,
+                    "artist_id": artist_ids,
+                    "week": [week.date()] * len(ranks),
+                    "rank": ranks,
+                },
+                schema=CHART_SCHEMA,
+            )
+            partition = os.path.join(self.root, "weeks", f"year={week.year}")
+            os.makedirs(partition, exist_ok=True)
+            write_parquet_atomic(
+                table, os.path.join(partition, f"week-{week:%Y-%m-%d}.parquet")
+            )
+            self.stored_weeks.add(week)
+
+    # Function to merge the weekly files of each year into a single part file,
+    # refresh the credit tables for the songs added since the last run and
+    # fold the new weeks into the rollups
+    def compact(self):
+        self.compact_partitions()
+        self.update_rollups(self.update_credits())
+
+    # Function to merge the weekly files of the given years (all by default)
+    # into a single part file per year; force rewrites compacted years too
+    def compact_partitions(self, years=None, force=False):
+        with self._lock:
+            for partition in sorted(
+                glob.glob(os.path.join(self.root, "weeks", "year=*"))
+            ):
+                year = partition.rsplit("=", 1)[1]
+                if years is not None and year not in years:
+                    continue
+                files = partition_files(self.root, year)
+                if force or len(files) > 1 or not files[0].endswith("part-0.parquet"):
+                    self._rewrite_partition(partition, files)
+
+    # Function to parse the credits of every stored song into the credit
+    # tables, returning the credits
+    def update_credits(self):
+        with self._lock:
+            artists = pd.DataFrame(
+                {"artist_id": range(len(self.artists)), "Artist": self.artists}
+            )
+            songs = pd.DataFrame(
+                {
+                    "song_id": range(len(self.songs)),
+                    "artist_id": [artist_id for artist_id, _ in self.songs],
+                }
+            )
+            _, credits = write_credits(self.root, artists, songs)
+            return credits
+
+    # Function to fold the weeks stored since the rollups were written into
+    # them (or recompute them from every week when rebuild is set)
+    def update_rollups(self, credits=None, rebuild=False):
+        with self._lock:
+            if credits is None:
+                credits = read_parquet_mapped(
+                    os.path.join(self.root, "credits.parquet")
+                ).to_pandas()
+            rollups = None if rebuild else read_rollups(self.root)
+            if rollups is not None and rollups[2] <= self.stored_weeks:
+                # Only the weeks appended since the rollups were written are read
+                song_stats, _, covered = rollups
+                new_weeks = self.stored_weeks - covered
+                if new_weeks:
+                    new_stats = song_rollups(read_weeks(self.root, new_weeks))
+                    song_stats = merge_song_rollups(song_stats, new_stats)
+            else:
+                song_stats = song_rollups(read_weeks(self.root, self.stored_weeks))
+            write_rollups(
+                self.root,
+                song_stats,
+                performer_rollups(song_stats, credits),
+                self.stored_weeks,
+            )
+
+    def _artist_id(self, artist):
+        if artist not in self.artist_ids:
+            self.artist_ids[artist] = len(self.artists)
+            self.artists.append(artist)
+        return self.artist_ids[artist]
+
+    def _song_id(self, artist, song):
+        if (artist, song) not in self.song_ids:
+            self.song_ids[(artist, song)] = len(self.songs)
+            self.songs.append((self.artist_ids[artist], song))
+        return self.song_ids[(artist, song)]
+
+    def _write_dimensions(self):
+        artists = pa.Table.from_pydict(
+            {"artist_id": list(range(len(self.artists))), "Artist": self.artists},
+            schema=ARTISTS_SCHEMA,
+        )
+        songs = pa.Table.from_pydict(
+            {
+                "song_id": list(range(len(self.songs))),
+                "artist_id": [artist_id for artist_id, _ in self.songs],
+                "Song": [song for _, song in self.songs],
+            },
+            schema=SONGS_SCHEMA,
+        )
+        write_parquet_atomic(artists, os.path.join(self.root, "artists.parquet"))
+        write_parquet_atomic(songs, os.path.join(self.root, "songs.parquet"))
+
+    def _drop_week(self, week):
+        # The rollups may count the old copy of the week; rebuild them at the
+        # next compaction
+        remove_rollups(self.root)
+        partition = os.path.join(self.root, "weeks", f"year={week.year}")
+        self._rewrite_partition(
+            partition, partition_files(self.root, week.year), drop_week=week
+        )
+        self.stored_weeks.discard(week)
+
+    def _rewrite_partition(self, partition, files, drop_week=None):
+        table = read_partition_files(files)
+        if drop_week is not None:
+            table = table.filter(
+                pc.not_equal(table.column("week"), pa.scalar(drop_week.date()))
+            )
+        table = table.sort_by([("week", "ascending"), ("rank", "ascending")])
+        target = os.path.join(partition, "part-0.parquet")
+        write_parquet_atomic(table, target)
+        for path in files:
+            if path != target:
+                os.remove(path)
+
+
+class ChartStore:
+    def __init__(
+        self, chart, songs, artists, performers, credits, song_stats, performer_stats
+    ):
+        # Long chart rows: song_id, artist_id, week (datetime64), rank (uint8)
+        self.chart = chart
+        # Song dimension indexed by song_id: artist_id, Artist, Song (categoricals)
+        self.songs = songs
+        # Artist (credit string) dimension indexed by artist_id: Artist
+        self.artists = artists
+        # Individual performers indexed by performer_id: Artist
+        self.performers = performers
+        # Song <-> performer bridge: song_id, performer_id, role
+        self.credits = credits
+        # Rollups indexed by song_id / performer_id (see chart_rollups.py)
+        self.song_stats = song_stats
+        self.performer_stats = performer_stats
+        # Sorted list of every week present in the store
+        self.weeks = pd.DatetimeIndex(np.unique(chart["week"].values))
+        # Ids of the songs with chart rows. Dimensions are written before the
+        # week files and a refetched week may drop songs, so some ids can have
+        # no rows; they are left out of the credits, selectors and searches.
+        self.charted_song_ids = np.unique(chart["song_id"].to_numpy())
+
+        # Charted song ids grouped by performer, so one performer's songs are
+        # a slice
+        charted = credits[np.isin(credits["song_id"].to_numpy(), self.charted_song_ids)]
+        by_performer = np.argsort(charted["performer_id"].to_numpy(), kind="stable")
+        self._performer_song_ids = charted["song_id"].to_numpy()[by_performer]
+        self._performer_offsets = np.searchsorted(
+            charted["performer_id"].to_numpy()[by_performer],
+            np.arange(len(performers) + 1),
+        )
+
+    # Function to get the ids of every song credited to a performer
+    def performer_song_ids(self, performer_id):
+        start, end = self._performer_offsets[[performer_id, performer_id + 1]]
+        return self._performer_song_ids[start:end]
+
+    # Function to count charted songs per performer among the given songs
+    def performer_song_counts(self, song_ids=None):
+        performer_ids = np.repeat(
+            self.performers.index.to_numpy(), np.diff(self._performer_offsets)
+        )
+        if song_ids is not None:
+            performer_ids = performer_ids[np.isin(self._performer_song_ids, song_ids)]
+        counts = np.bincount(performer_ids, minlength=len(self.performers))
+        return pd.Series(counts, index=self.performers.index, name="songs")
+
+
+# Function to open a chart store written by write_chart_store
+def load_chart_store(root=CHART_STORE_DIR):
+    artists = read_parquet_mapped(os.path.join(root, "artists.parquet")).to_pandas()
+    songs = read_parquet_mapped(os.path.join(root, "songs.parquet")).to_pandas()
+
+    chart = read_partition_files(partition_files(root)).to_pandas(date_as_object=False)
+
+    artists = artists.set_index("artist_id")
+    songs = songs.set_index("song_id")
+    # Artist and Song are categoricals: one copy of every name, int codes per song
+    songs["Artist"] = pd.Categorical.from_codes(
+        songs["artist_id"].to_numpy(), categories=artists["Artist"]
+    )
+    songs["Song"] = songs["Song"].astype("category")
+    songs = songs[["artist_id", "Artist", "Song"]]
+
+    credits_file = os.path.join(root, "credits.parquet")
+    if os.path.exists(credits_file):
+        performers = read_parquet_mapped(os.path.join(root, "performers.parquet"))
+        credits = read_parquet_mapped(credits_file).to_pandas()
+        performers = performers.to_pandas()
+    if not os.path.exists(credits_file) or credits["song_id"].max() < songs.index[-1]:
+        # Weeks appended since the last compaction: parse credits in memory
+        performers, credits = build_credits(artists, songs)
+    credits["role"] = pd.Categorical(credits["role"], categories=ROLES)
+    performers = performers.set_index("performer_id")
+
+    rollups = read_rollups(root)
+    if rollups is None or rollups[2] != set(chart["week"]):
+        # Weeks appended since the last compaction: roll up in memory
+        song_stats = song_rollups(chart)
+        rollups = song_stats, performer_rollups(song_stats, credits), None
+    song_stats, performer_stats, _ = rollups
+    return ChartStore(
+        chart, songs, artists, performers, credits, song_stats, performer_stats
+    )
+
+
+# %%
+# Convert a legacy wide workbook into a chart store:
+#   python chart_store.py songs_df.xlsx [chart_store]
+if __name__ == "__main__":
+    excel_file_name = sys.argv[1] if len(sys.argv) > 1 else "songs_df.xlsx"
+    root = sys.argv[2] if len(sys.argv) > 2 else CHART_STORE_DIR
+    songs_df = pd.read_excel(excel_file_name)
+    write_chart_store(long_from_wide(songs_df), root)
+    print(f"Wrote {root} from {excel_file_name}")
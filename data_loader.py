@@ -0,0 +1,364 @@
+# %%
+# Process-wide loader for the datasets used by App.py.
+#
+# Streamlit re-executes App.py on every widget interaction in every session,
+# but imported modules stay loaded, so the cache below lives once per process.
+# Each dataset is parsed once, shared by all sessions, and reloaded only when
+# its source files change: a changed mtime/size triggers a content hash, and
+# only a changed hash triggers a new parse. Loaded values are shared between
+# sessions and must be treated as read-only. With BILLBOARD_SHARED set, they
+# are attached from a snapshot shared by every process (see shared_datasets.py).
+import hashlib
+import logging
+import operator
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from chart_index import ChartRangeIndex, SongTrajectories, WeekIndex
+from chart_store import CHART_STORE_DIR, load_chart_store
+from genre_tagger import GENRE_FILE, GenreIndex, load_genre_tags
+from search_index import artist_search_index, song_search_index
+from shared_datasets import (
+    SHARED_DIR,
+    attach_snapshot,
+    current_path,
+    current_version,
+    write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+# Reads of a dataset never loaded before, while a writer swaps its files
+READ_ATTEMPTS = 5
+READ_RETRY_DELAY = 0.2
+
+
+# Function to list every file behind a source path (a file or a directory)
+def source_files(path):
+    if os.path.isdir(path):
+        files = []
+        for folder, _, names in os.walk(path):
+            files.extend(os.path.join(folder, name) for name in names)
+        return sorted(files)
+    return [path]
+
+
+# Function to get a cheap fingerprint (path, mtime, size) of the source files
+def stat_signature(paths):
+    signature = []
+    for path in paths:
+        for file in source_files(path):
+            stat = os.stat(file)
+            signature.append((file, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+# Function to hash the content of the source files
+def content_hash(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        for file in source_files(path):
+            digest.update(os.path.relpath(file, path).encode())
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+class DatasetCache:
+    def __init__(self, check_interval=1.0):
+        # Seconds between two stat() checks of the same dataset's sources
+        self.check_interval = check_interval
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    # Function to declare a dataset by its source paths and loader function
+    def register(self, name, paths, loader):
+        with self._lock:
+            self._datasets[name] = {
+                "paths": list(paths),
+                "loader": loader,
+                "lock": threading.Lock(),
+                "value": None,
+                "version": None,
+                "signature": None,
+                "checked_at": 0.0,
+                "hits": 0,
+                "misses": 0,
+            }
+
+    # Function to declare a dataset computed from other datasets (e.g. an index);
+    # it is rebuilt only when one of its dependencies changes version
+    def register_derived(self, name, deps, builder):
+        self.register(name, [], builder)
+        self._datasets[name]["deps"] = list(deps)
+
+    # Function to return the dataset, parsing it only if its sources changed
+    def get(self, name):
+        entry = self._datasets[name]
+        if "deps" in entry:
+            return self._get_derived(name, entry)
+        # One lock per dataset: concurrent sessions wait for a single parse
+        with entry["lock"]:
+            if entry["version"] is not None and not self._is_stale(entry):
+                entry["hits"] += 1
+                return entry["value"]
+
+            try:
+                signature, version, value, seconds = self._read(entry)
+            except OSError as error:
+                # A writer renamed or removed a file while it was read: keep
+                # serving the loaded value, and since the signature stays
+                # stale, retry at the next check
+                logger.warning("Could not reload dataset %s: %s", name, error)
+                entry["hits"] += 1
+                return entry["value"]
+            if version != entry["version"]:
+                entry["value"] = value
+                entry["version"] = version
+                entry["misses"] += 1
+                logger.info(
+                    "Loaded dataset %s (version %s) in %.3fs; hits=%d misses=%d",
+                    name,
+                    version[:12],
+                    seconds,
+                    entry["hits"],
+                    entry["misses"],
+                )
+            else:
+                # Touched but unchanged files keep the parsed value
+                entry["hits"] += 1
+            entry["signature"] = signature
+            entry["checked_at"] = time.monotonic()
+            return entry["value"]
+
+    # Function to fingerprint, hash and (if its version changed) load a
+    # dataset's sources. Files a writer swaps mid-read raise OSError; without a
+    # loaded value to fall back on, the read is retried a few times first.
+    def _read(self, entry):
+        for attempt in range(READ_ATTEMPTS):
+            try:
+                signature = stat_signature(entry["paths"])
+                version = content_hash(entry["paths"])
+                if version == entry["version"]:
+                    return signature, version, None, 0.0
+                started = time.perf_counter()
+                value = entry["loader"]()
+                return signature, version, value, time.perf_counter() - started
+            except OSError:
+                if entry["version"] is not None or attempt == READ_ATTEMPTS - 1:
+                    raise
+                time.sleep(READ_RETRY_DELAY)
+
+    def _get_derived(self, name, entry):
+        values = [self.get(dep) for dep in entry["deps"]]
+        version = hashlib.sha256(
+            "".join(self.version(dep) for dep in entry["deps"]).encode()
+        ).hexdigest()
+        with entry["lock"]:
+            if version == entry["version"]:
+                entry["hits"] += 1
+                return entry["value"]
+            started = time.perf_counter()
+            entry["value"] = entry["loader"](*values)
+            entry["version"] = version
+            entry["misses"] += 1
+            logger.info(
+                "Built dataset %s from %s in %.3fs; hits=%d misses=%d",
+                name,
+                ", ".join(entry["deps"]),
+                time.perf_counter() - started,
+                entry["hits"],
+                entry["misses"],
+            )
+            return entry["value"]
+
+    # Function to check whether a dataset's sources changed since it was loaded
+    def _is_stale(self, entry):
+        now = time.monotonic()
+        if now - entry["checked_at"] < self.check_interval:
+            return False
+        entry["checked_at"] = now
+        try:
+            return stat_signature(entry["paths"]) != entry["signature"]
+        except OSError:
+            # Sources are being swapped by a writer; keep serving the loaded value
+            return False
+
+    # Function to get the content hash of the currently loaded dataset
+    def version(self, name):
+        return self._datasets[name]["version"]
+
+    # Function to get the versions of the datasets loaded from files; derived
+    # datasets only change when these do
+    def source_versions(self):
+        return tuple(
+            (name, entry["version"])
+            for name, entry in self._datasets.items()
+            if "deps" not in entry
+        )
+
+    # Function to list the source files behind every derived dataset, by
+    # following its dependencies down to the registered paths
+    def derived_sources(self):
+        def paths(name):
+            entry = self._datasets[name]
+            if "deps" not in entry:
+                return entry["paths"]
+            return [path for dep in entry["deps"] for path in paths(dep)]
+
+        return {
+            name: sorted(set(paths(name)))
+            for name, entry in self._datasets.items()
+            if "deps" in entry
+        }
+
+    # Function to list the registered datasets
+    def names(self):
+        return list(self._datasets)
+
+    # Function to report hit/miss counters per dataset
+    def stats(self):
+        return {
+            name: {
+                "hits": entry["hits"],
+                "misses": entry["misses"],
+                "version": entry["version"],
+            }
+            for name, entry in self._datasets.items()
+        }
+
+
+class SectionCache:
+    # Bounded LRU cache for the results of dashboard sections, keyed on
+    # (section, inputs) and shared by all sessions. Every entry belongs to the
+    # dataset versions it was computed from: when any dataset reloads, the
+    # whole cache is dropped. Cached values must be treated as read-only.
+    def __init__(self, dataset_cache, max_entries=256):
+        self.dataset_cache = dataset_cache
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._data_version = None
+        self._sections = {}
+        self._lock = threading.Lock()
+
+    # Function to return a section's result for the given inputs, computing it
+    # with compute() on a miss
+    def get(self, section, key, compute):
+        data_version = self._current_data_version()
+        with self._lock:
+            counters = self._sections.setdefault(
+                section, {"hits": 0, "misses": 0, "evictions": 0}
+            )
+            if data_version != self._data_version:
+                self._entries.clear()
+                self._data_version = data_version
+            if (section, key) in self._entries:
+                self._entries.move_to_end((section, key))
+                counters["hits"] += 1
+                return self._entries[(section, key)]
+            counters["misses"] += 1
+
+        # Computed outside the lock so other sections are not held up
+        value = compute()
+        with self._lock:
+            if data_version == self._data_version:
+                self._entries[(section, key)] = value
+                while len(self._entries) > self.max_entries:
+                    (evicted, _), _ = self._entries.popitem(last=False)
+                    self._sections[evicted]["evictions"] += 1
+        return value
+
+    def _current_data_version(self):
+        return self.dataset_cache.source_versions()
+
+    # Function to report hit/miss counters and hit rate per section
+    def stats(self):
+        with self._lock:
+            entries = {}
+            for section, _ in self._entries:
+                entries[section] = entries.get(section, 0) + 1
+            return {
+                section: {
+                    **counters,
+                    "hit_rate": counters["hits"]
+                    / max(counters["hits"] + counters["misses"], 1),
+                    "entries": entries.get(section, 0),
+                }
+                for section, counters in self._sections.items()
+            }
+
+
+# Function to register every dataset, loaded and built by this process
+def private_dataset_cache():
+    cache = DatasetCache()
+    cache.register(
+        "charts", [CHART_STORE_DIR], lambda: load_chart_store(CHART_STORE_DIR)
+    )
+    cache.register("genres", [GENRE_FILE], lambda: load_genre_tags(GENRE_FILE))
+    cache.register_derived("genre_index", ["charts", "genres"], GenreIndex)
+    cache.register_derived("week_index", ["charts"], WeekIndex)
+    cache.register_derived("song_trajectories", ["charts"], SongTrajectories)
+    cache.register_derived("range_index", ["charts"], ChartRangeIndex)
+    cache.register_derived("song_search", ["charts"], song_search_index)
+    cache.register_derived("artist_search", ["charts"], artist_search_index)
+    return cache
+
+
+# Function to register every dataset as a part of the snapshot published in
+# root (see shared_datasets.py). The snapshot is one dataset, reloaded when
+# CURRENT changes, so all datasets swap to a new version together.
+def shared_dataset_cache(root):
+    private = private_dataset_cache()
+
+    def attach():
+        try:
+            return attach_snapshot(root)[1]
+        except (ValueError, OSError, EOFError, pickle.UnpicklingError) as error:
+            # Published by other code, or its folder pruned or damaged: build
+            # this process's own until the snapshot is republished
+            logger.warning("%s; loading the datasets privately", error)
+            return {name: private.get(name) for name in private.names()}
+
+    cache = DatasetCache()
+    cache.register("snapshot", [current_path(root)], attach)
+    for name in private.names():
+        cache.register_derived(name, ["snapshot"], operator.itemgetter(name))
+    return cache
+
+
+# Function to build every dataset in this process and publish them as the
+# current snapshot in root; returns its version
+def publish_shared(root=SHARED_DIR):
+    private = private_dataset_cache()
+    values = {name: private.get(name) for name in private.names()}
+    return write_snapshot(values, repr(private.source_versions()), root)
+
+
+# Process-wide cache shared by every Streamlit session. With BILLBOARD_SHARED
+# set to a folder with a published snapshot, the datasets are attached from it
+# (shared by every process of the host) instead of loaded by this process.
+SHARED_ROOT = os.environ.get("BILLBOARD_SHARED")
+if SHARED_ROOT and current_version(SHARED_ROOT) is not None:
+    dataset_cache = shared_dataset_cache(SHARED_ROOT)
+else:
+    if SHARED_ROOT:
+        logger.warning("No snapshot published in %s; loading privately", SHARED_ROOT)
+    dataset_cache = private_dataset_cache()
+
+
+# Function to get a shared, read-only dataset by name
+def load_dataset(name):
+    return dataset_cache.get(name)
+
+
+# Process-wide cache of dashboard section results
+section_cache = SectionCache(dataset_cache)
+
+
+# Function to memoize a dashboard section's result on its inputs
+def memoize(section, key, compute):
+    return section_cache.get(section, key, compute)
@@ -0,0 +1,295 @@
+# %%
+# Genre tagging for artists, stored as one bitmask per artist.
+#
+# The Wikipedia "Genres" text of every artist is tokenized once and matched
+# against all genres of the taxonomy in a single pass with one compiled
+# pattern. Genres are matched as whole words, longest phrase first, so
+# "hard rock" is tagged as hard rock (not also as rock) and "pop" no longer
+# matches inside words such as "electropop". Glued infobox items are split
+# apart, but never inside compound genre words, and hyphenated compounds are
+# tagged like their one-word spelling ("synth-pop" like "synthpop"). Each artist gets a uint64 with
+# one bit per genre, stored next to the raw text in genres.parquet, with the
+# taxonomy (bit order) kept in the file metadata.
+import json
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+GENRE_FILE = "genres.parquet"
+
+# Genres in bit order, each with the phrases that count as that genre
+GENRE_TAXONOMY = {
+    "rock": ["rock", "rock and roll", "rock 'n' roll"],
+    "pop": ["pop"],
+    "jazz": ["jazz"],
+    "fusion": ["fusion"],
+    "soul": ["soul"],
+    "r&b": ["r&b", "rhythm and blues"],
+    "folk": ["folk"],
+    "hip hop": ["hip hop", "hip-hop"],
+    "dance": ["dance"],
+    "hard rock": ["hard rock"],
+    "soft rock": ["soft rock"],
+    "metal": ["metal", "heavy metal"],
+    "glam": ["glam", "glam rock", "glam metal"],
+    "new wave": ["new wave"],
+    "swing": ["swing"],
+    "blues": ["blues"],
+    "funk": ["funk"],
+    "progressive": ["progressive"],
+    "country": ["country"],
+    "reggae": ["reggae"],
+    "brit": ["brit", "britpop", "brit pop", "brit-pop"],
+    "electronic": ["electronic", "electronica"],
+    "psychedelic": ["psychedelic", "psychedelia"],
+    "rap": ["rap"],
+    "latin": ["latin"],
+    "freestyle": ["freestyle"],
+    "synth": ["synth", "synthpop", "synth-pop", "synthwave"],
+    "gothic": ["gothic", "goth"],
+    "alternative": ["alternative"],
+    "house": ["house"],
+    "christian": ["christian"],
+    "salsa": ["salsa"],
+    "indie": ["indie"],
+    "gospel": ["gospel"],
+    "christmas": ["christmas"],
+    "children": ["children", "children's music"],
+    "edm": ["edm", "electronic dance music"],
+}
+
+# Common genre words outside the taxonomy, used to split glued infobox items
+GENRE_WORDS = [
+    "punk",
+    "music",
+    "revival",
+    "grunge",
+    "garage",
+    "power",
+    "post",
+    "college",
+    "industrial",
+    "shock",
+    "trap",
+    "techno",
+    "trance",
+    "teen",
+    "urban",
+    "contemporary",
+    "adult",
+    "experimental",
+    "disco",
+    "dub",
+    "blue",
+    "big",
+    "bossa",
+    "vocal",
+    "comedy",
+    "bubblegum",
+    "dream",
+    "electro",
+    "quiet",
+    "easy",
+    "smooth",
+    "southern",
+    "traditional",
+]
+
+# Single words made of genre words that are one genre and must not be split
+# as glued items ("electropop" is not electro and pop); taxonomy aliases of
+# one word ("synthpop", "britpop") are kept whole too
+GENRE_COMPOUNDS = [
+    "electropop",
+    "europop",
+    "eurodance",
+    "dancehall",
+    "bluegrass",
+    "hardcore",
+]
+
+
+class GenreTags:
+    def __init__(self, frame, genres):
+        # One row per artist: Artist, genre_mask (and Genre text if loaded)
+        self.frame = frame
+        # Genre names in bit order
+        self.genres = list(genres)
+        self.bits = {
+            genre: np.uint64(1) << np.uint64(i) for i, genre in enumerate(genres)
+        }
+
+    # Function to combine genre names into a single bitmask
+    def mask(self, genres):
+        mask = np.uint64(0)
+        for genre in genres:
+            mask |= self.bits[genre]
+        return mask
+
+    # Function to expand the bitmasks into 0/1 columns, one per genre
+    def one_hot(self):
+        masks = self.frame["genre_mask"].to_numpy()
+        return pd.DataFrame(
+            {
+                genre: ((masks & bit) != 0).astype("uint8")
+                for genre, bit in self.bits.items()
+            },
+            index=self.frame.index,
+        )
+
+
+class GenreIndex:
+    # Genre lookup over the chart store's songs. Every song carries the genre
+    # bitmask of its artist (each artist's mask copied onto its songs), so a
+    # genre selection resolves to song ids with one vectorized bitwise test
+    # and a take, without touching strings.
+    def __init__(self, chart_store, genre_tags):
+        self.genres = genre_tags.genres
+        self.bits = genre_tags.bits
+        self.mask = genre_tags.mask
+
+        # Genre bitmask per artist_id of the chart store (0 if untagged)
+        tags = genre_tags.frame
+        positions = pd.Index(tags["Artist"]).get_indexer(chart_store.artists["Artist"])
+        self.artist_masks = np.where(
+            positions >= 0,
+            tags["genre_mask"].to_numpy()[positions],
+            np.uint64(0),
+        ).astype("uint64")
+
+        # Genre bitmask per charted song, aligned with song_ids
+        self.song_ids = chart_store.charted_song_ids
+        song_artists = chart_store.songs["artist_id"].to_numpy()[self.song_ids]
+        self.song_masks = self.artist_masks[song_artists]
+
+    # Function to get the ids of songs matching any (OR) or all (AND) genres
+    def song_ids_for(self, genres, match="any"):
+        mask = self.mask(genres)
+        if match == "all":
+            hits = (self.song_masks & mask) == mask
+        else:
+            hits = (self.song_masks & mask) != 0
+        return self.song_ids[hits]
+
+
+# Function to compile the taxonomy into one alternation, longest phrase first
+def build_genre_matcher(taxonomy=GENRE_TAXONOMY):
+    phrases = {}
+    for bit, aliases in enumerate(taxonomy.values()):
+        for alias in aliases:
+            phrases[alias] = bit
+    alternation = "|".join(
+        re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True)
+    )
+    return re.compile(rf"(?<!\w)(?:{alternation})(?!\w)"), phrases
+
+
+# Function to get the compound genre words, which are never split
+def genre_compounds(taxonomy=GENRE_TAXONOMY):
+    aliases = [alias for aliases in taxonomy.values() for alias in aliases]
+    return {alias for alias in aliases if re.fullmatch(r"\w+", alias)} | set(
+        GENRE_COMPOUNDS
+    )
+
+
+# Function to build the replacement splitting a genre word glued to the next
+# genre ("rockhard rock"), from the first and last words of the taxonomy
+# phrases: returns the pattern and a function for re.sub. Compounds are
+# matched as a whole where they fit, so nothing is split inside them
+def build_glue_splitter(taxonomy=GENRE_TAXONOMY):
+    phrases = [alias for aliases in taxonomy.values() for alias in aliases]
+    compounds = genre_compounds(taxonomy)
+    ends = {phrase.split()[-1] for phrase in phrases} | set(GENRE_WORDS) | compounds
+    starts = {phrase.split()[0] for phrase in phrases} | set(GENRE_WORDS) | compounds
+    ends = "|".join(re.escape(word) for word in sorted(ends, key=len, reverse=True))
+    starts = re.compile(
+        "|".join(re.escape(word) for word in sorted(starts, key=len, reverse=True))
+    )
+
+    def split(match):
+        glued = starts.match(match.string, match.end()) is not None
+        return match.group(0) + "\n" if glued else match.group(0)
+
+    # A word counts only where it ends the item or another genre follows
+    return rf"(?:{ends})(?=(?:{starts.pattern})|(?!\w))", split
+
+
+# Function to build the replacement spelling hyphenated compounds ("synth-pop")
+# as one word, so that they are tagged like the glued spelling ("synthpop")
+def build_compound_joiner(taxonomy=GENRE_TAXONOMY):
+    compounds = genre_compounds(taxonomy)
+
+    def join(match):
+        joined = match.group(1) + match.group(2)
+        return joined if joined in compounds else match.group(0)
+
+    return r"\b(\w+)-(\w+)\b", join
+
+
+# Function to normalize raw Wikipedia genre text before matching
+def normalize_genre_text(genre_text, taxonomy=GENRE_TAXONOMY):
+    text = genre_text.fillna("").astype(str).str.replace("\xa0", " ")
+    # Drop citation markers such as [1] or [a]
+    text = text.str.replace(r"\[[^\]]*\]", " ", regex=True)
+    # Infobox list items are often glued together ("FolkBlues", "Rockhard rock")
+    text = text.str.replace(r"(?<=[a-z])(?=[A-Z])", "\n", regex=True).str.lower()
+    text = text.str.replace(*build_compound_joiner(taxonomy), regex=True)
+    return text.str.replace(*build_glue_splitter(taxonomy), regex=True)
+
+
+# Function to tag every genre text with a bitmask of matched genres
+def tag_genres(genre_text, taxonomy=GENRE_TAXONOMY):
+    matcher, phrases = build_genre_matcher(taxonomy)
+    genre_text = pd.Series(genre_text).reset_index(drop=True)
+    matches = normalize_genre_text(genre_text, taxonomy).str.findall(matcher)
+    matches = matches.explode().dropna()
+
+    masks = np.zeros(len(genre_text), dtype="uint64")
+    bits = np.left_shift(np.uint64(1), matches.map(phrases).to_numpy(dtype="uint64"))
+    np.bitwise_or.at(masks, matches.index.to_numpy(), bits)
+    return masks
+
+
+# Function to tag artists (Artist, Genre) and save them with their bitmasks
+def write_genre_tags(genre_df, path=GENRE_FILE, taxonomy=GENRE_TAXONOMY):
+    table = pa.table(
+        {
+            "Artist": pa.array(genre_df["Artist"].astype(str), pa.string()),
+            "Genre": pa.array(
+                genre_df["Genre"].where(genre_df["Genre"].notna(), None), pa.string()
+            ),
+            "genre_mask": pa.array(
+                tag_genres(genre_df["Genre"], taxonomy), pa.uint64()
+            ),
+        }
+    )
+    metadata = {b"genres": json.dumps(list(taxonomy)).encode()}
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+# Function to load artist genre bitmasks; the raw Genre text is skipped unless
+# asked for, since only the masks are needed for filtering
+def load_genre_tags(path=GENRE_FILE, columns=("Artist", "genre_mask")):
+    table = pq.read_table(path, columns=list(columns), memory_map=True)
+    genres = json.loads(pq.read_schema(path).metadata[b"genres"])
+    return GenreTags(table.to_pandas(), genres)
+
+
+# Function to re-tag a stored genre file with another taxonomy
+def retag_genres(path=GENRE_FILE, taxonomy=GENRE_TAXONOMY):
+    genre_df = load_genre_tags(path, columns=("Artist", "Genre")).frame
+    write_genre_tags(genre_df, path, taxonomy)
+
+
+# %%
+# Build genres.parquet from a workbook with Artist and Genre columns:
+#   python genre_tagger.py genre_df.xlsx [genres.parquet]
+if __name__ == "__main__":
+    excel_file_name = sys.argv[1] if len(sys.argv) > 1 else "genre_df.xlsx"
+    path = sys.argv[2] if len(sys.argv) > 2 else GENRE_FILE
+    genre_df = pd.read_excel(excel_file_name, usecols=["Artist", "Genre"])
+    write_genre_tags(genre_df, path)
+    print(f"Wrote {path} from {excel_file_name}")
@@ -0,0 +1,270 @@
+# %%
+# Persistent on-disk cache for the HTTP pages fetched by the scraper.
+#
+# Layout of a cache directory:
+#   index.sqlite          one row per URL: status, validators, body hash, times
+#   bodies/ab/abcdef...   response bodies, named by the SHA-256 of their content
+#
+# A fresh entry (younger than its TTL) is served without touching the network.
+# A stale entry is revalidated with If-None-Match / If-Modified-Since, so an
+# unchanged page costs a 304 instead of a full download. The total body size
+# is bounded and the least recently used entries are evicted first. In offline
+# mode every request is answered from the cache, whatever its age, so the
+# whole ingestion can be replayed without network access.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+HTTP_CACHE_DIR = "http_cache"
+
+# Responses worth keeping: pages and confirmed missing pages
+CACHEABLE_STATUS_CODES = {200, 404}
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+class CachedResponse:
+    # The subset of requests.Response used by the scraper
+    def __init__(self, url, status_code, content, headers, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code} for {self.url}")
+
+
+class HttpCache:
+    def __init__(
+        self,
+        root=HTTP_CACHE_DIR,
+        ttl=30 * 24 * 3600,
+        max_bytes=2 * 1024**3,
+        offline=False,
+    ):
+        self.root = root
+        # Default number of seconds an entry is served without revalidation
+        self.ttl = ttl
+        # Upper bound on the total size of the stored bodies
+        self.max_bytes = max_bytes
+        # Serve everything from the cache and never touch the network
+        self.offline = offline
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        os.makedirs(os.path.join(root, "bodies"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), check_same_thread=False
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                body_hash TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_type TEXT,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)"
+        )
+        self._db.commit()
+
+    # Function to GET a URL through the cache; before_request is called only
+    # when the network is actually used (e.g. to take a rate limit token)
+    def get(self, url, session=None, timeout=None, ttl=None, before_request=None):
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._lookup(url)
+        now = time.time()
+
+        if entry is not None and (self.offline or now - entry["fetched_at"] < ttl):
+            self.hits += 1
+            return self._cached_response(url, entry, now)
+        if self.offline:
+            raise OfflineCacheMiss(f"Not in the offline HTTP cache: {url}")
+
+        # Stale entries are revalidated instead of downloaded again
+        headers = {}
+        if entry is not None and entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        if before_request is not None:
+            before_request()
+        response = (session or requests).get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and entry is not None:
+            self.revalidated += 1
+            with self._lock:
+                self._db.execute(
+                    "UPDATE responses SET fetched_at = ?, used_at = ? WHERE url = ?",
+                    (now, now, url),
+                )
+                self._db.commit()
+            return self._cached_response(url, entry, now)
+
+        self.misses += 1
+        if response.status_code in CACHEABLE_STATUS_CODES:
+            self._store(url, response, now)
+        return CachedResponse(
+            url,
+            response.status_code,
+            response.content,
+            dict(response.headers),
+            from_cache=False,
+        )
+
+    # Function to drop a URL from the cache, e.g. a page that turned out to be
+    # incomplete, so that the next request fetches it again
+    def forget(self, url):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT body_hash FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is not None:
+                self._delete(url, row[0])
+                self._db.commit()
+
+    # Function to map the URLs with a cached page (status 200) to the files
+    # holding their bodies, e.g. to re-parse them in other processes
+    def body_paths(self, urls):
+        paths = {}
+        with self._lock:
+            for url in urls:
+                row = self._db.execute(
+                    "SELECT body_hash FROM responses WHERE url = ? AND status = 200",
+                    (url,),
+                ).fetchone()
+                if row is not None and os.path.exists(self._body_path(row[0])):
+                    paths[url] = self._body_path(row[0])
+        return paths
+
+    # Function to report cache counters and size
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    # Function to get the index row and body of a URL, or None if not cached
+    def _lookup(self, url):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, body_hash, etag, last_modified, content_type, "
+                "fetched_at FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ["status", "body_hash", "etag", "last_modified", "content_type"]
+        entry = dict(zip(keys + ["fetched_at"], row))
+        try:
+            with open(self._body_path(entry["body_hash"]), "rb") as f:
+                entry["content"] = f.read()
+        except FileNotFoundError:
+            # Body removed from disk: forget the entry and fetch it again
+            with self._lock:
+                self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self._db.commit()
+            return None
+        return entry
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.root, "bodies", body_hash[:2], body_hash)
+
+    def _cached_response(self, url, entry, now):
+        with self._lock:
+            self._db.execute(
+                "UPDATE responses SET used_at = ? WHERE url = ?", (now, url)
+            )
+            self._db.commit()
+        headers = {"Content-Type": entry["content_type"] or ""}
+        return CachedResponse(
+            url, entry["status"], entry["content"], headers, from_cache=True
+        )
+
+    def _store(self, url, response, now):
+        content = response.content
+        body_hash = hashlib.sha256(content).hexdigest()
+        path = self._body_path(body_hash)
+        # Identical bodies are stored once, whatever URL they came from
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            staging = f"{path}.{threading.get_ident()}.tmp"
+            with open(staging, "wb") as f:
+                f.write(content)
+            os.replace(staging, path)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    response.status_code,
+                    body_hash,
+                    len(content),
+                    response.headers.get("ETag"),
+                    response.headers.get("Last-Modified"),
+                    response.headers.get("Content-Type"),
+                    now,
+                    now,
+                ),
+            )
+            self._evict()
+            self._db.commit()
+
+    # Function to drop least recently used entries until under max_bytes
+    def _evict(self):
+        (total,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT url, body_hash, size FROM responses ORDER BY used_at"
+        ).fetchall()
+        for url, body_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._delete(url, body_hash)
+            total -= size
+
+    # Function to delete an entry, and its body unless another URL shares it
+    def _delete(self, url, body_hash):
+        self._db.execute("DELETE FROM responses WHERE url = ?", (url,))
+        (shared,) = self._db.execute(
+            "SELECT COUNT(*) FROM responses WHERE body_hash = ?", (body_hash,)
+        ).fetchone()
+        if not shared:
+            try:
+                os.remove(self._body_path(body_hash))
+            except FileNotFoundError:
+                pass
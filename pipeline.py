@@ -0,0 +1,396 @@
+# %%
+# Incremental rebuild of the chart data, as a small DAG of stages:
+#
+#   fetch -> normalize -> credits -> genres -> rollups -> indexes
+#
+# Every stage splits its work into partitions (chart weeks, year partitions,
+# artists, ...) and hashes the inputs of each one. pipeline.json records, per
+# chart and stage, the hash of the stage's code and the input hash every
+# partition was last built from. A partition reruns only when its input hash
+# changed, and every partition of a stage when its code changed. A new chart
+# week thus fetches one week, compacts one year, re-parses the credits only if
+# the week brought new songs, looks up the genres of new artists only and
+# folds one week into the rollups.
+#
+# A stage without a record (pipeline.json is not versioned, so on a fresh
+# checkout) adopts the partitions whose outputs already exist: the stored
+# weeks, the compacted years, the looked-up artists, ... and builds the rest.
+#
+#   python pipeline.py                       run the stale stages
+#   python pipeline.py --dry-run             report what would rebuild
+#   python pipeline.py --force genres        rebuild every partition of a stage
+#   python pipeline.py --mark-built          record the current outputs as built
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+import pyarrow.compute as pc
+
+from artist_genres import fetch_artist_genres
+from chart_fetcher import chart_size, chart_weeks, fetch_weeks
+from chart_store import (
+    DEFAULT_CHART,
+    ChartStoreWriter,
+    chart_store_dir,
+    partition_files,
+    read_parquet_mapped,
+    read_rollups,
+)
+from data_loader import content_hash, dataset_cache
+from genre_tagger import GENRE_FILE, load_genre_tags, retag_genres, write_genre_tags
+from http_cache import HTTP_CACHE_DIR, HttpCache
+
+PIPELINE_MANIFEST = "pipeline.json"
+
+# Stage name -> (upstream stages, modules whose code the outputs depend on).
+# fetch has no code version: Billboard does not revise published charts, so a
+# stored week stays valid (--force fetch refetches them all).
+STAGES = {
+    "fetch": ([], []),
+    "normalize": (["fetch"], ["chart_store"]),
+    "credits": (["normalize"], ["artist_credits"]),
+    "genres": (["normalize"], ["artist_genres"]),
+    "rollups": (["normalize", "credits"], ["chart_rollups"]),
+    "indexes": (
+        ["normalize", "credits", "genres", "rollups"],
+        ["chart_index", "search_index", "genre_tagger"],
+    ),
+}
+
+# Partition of the genres stage that re-tags genres.parquet
+GENRE_TAGS = "__tags__"
+
+
+# Function to hash strings into a short hex digest
+def short_hash(*parts):
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+# Function to hash the source code of the given modules (next to this file)
+def code_version(modules):
+    folder = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(folder, f"{module}.py") for module in modules]
+    return content_hash(paths)[:16] if paths else ""
+
+
+# Function to read the manifest of every chart (empty if never built)
+def read_manifest(path=PIPELINE_MANIFEST):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Function to write the manifest atomically
+def write_manifest(manifest, path=PIPELINE_MANIFEST):
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class ChartPipeline:
+    def __init__(
+        self,
+        chart_name=DEFAULT_CHART,
+        start="1990-01-01",
+        end="2022-12-31",
+        cache=None,
+        fetch_workers=8,
+        fetch_rate=2.0,
+        fetch_retries=5,
+        genre_workers=8,
+        manifest_path=PIPELINE_MANIFEST,
+    ):
+        self.chart_name = chart_name
+        self.root = chart_store_dir(chart_name)
+        self.weeks = chart_weeks(start, end)
+        self.cache = cache
+        self.fetch_workers = fetch_workers
+        self.fetch_rate = fetch_rate
+        self.fetch_retries = fetch_retries
+        self.genre_workers = genre_workers
+        self.manifest_path = manifest_path
+        self.writer = ChartStoreWriter(self.root)
+
+    # Function to hash the input of every partition of a stage
+    def partitions(self, stage):
+        return getattr(self, f"_{stage}_partitions")()
+
+    # Function to find the stale partitions of the given stages (all by
+    # default) from the manifest; stages listed in force are stale as a whole
+    def plan(self, force=(), stages=STAGES):
+        built = read_manifest(self.manifest_path).get(self.chart_name, {})
+        plan = {}
+        for stage in stages:
+            modules = STAGES[stage][1]
+            record = built.get(stage, {"code": None, "partitions": {}})
+            code = code_version(modules)
+            partitions = self.partitions(stage)
+            adopted = {}
+            if stage not in built and stage not in force:
+                # No record (pipeline.json is not versioned, e.g. on a fresh
+                # checkout): partitions whose outputs exist count as built
+                adopted = {p: partitions[p] for p in self._adopt(stage, partitions)}
+                record = {"code": code, "partitions": adopted}
+            if stage in force:
+                reason = "forced"
+            elif stage not in built:
+                reason = "never built"
+            elif record["code"] != code:
+                reason = "code changed"
+            else:
+                reason = None
+            rebuild = reason in ("forced", "code changed")
+            plan[stage] = {
+                "code": code,
+                "rebuild": rebuild,
+                "reason": reason,
+                "adopted": list(adopted),
+                "total": len(partitions),
+                "stale": [
+                    partition
+                    for partition, digest in partitions.items()
+                    if rebuild or record["partitions"].get(partition) != digest
+                ],
+            }
+        return plan
+
+    # Function to run the stale partitions of every stage in order, recording
+    # each finished stage in the manifest
+    def run(self, force=()):
+        for stage in STAGES:
+            # Upstream outputs have changed by now: plan each stage just before it
+            step = self.plan(force, [stage])[stage]
+            if step["adopted"]:
+                self._record(stage, step["code"], set(step["adopted"]), False)
+                print(f"{stage}: adopted {len(step['adopted'])} existing partitions")
+            if not step["stale"]:
+                print(f"{stage}: up to date")
+                continue
+            started = time.monotonic()
+            done = getattr(self, f"_{stage}_run")(step["stale"], step["rebuild"])
+            done = set(step["stale"] if done is None else done)
+            print(
+                f"{stage}: rebuilt {len(done)} of {step['total']} partitions "
+                f"in {time.monotonic() - started:.1f}s"
+            )
+            self._record(stage, step["code"], done, step["rebuild"])
+
+    # Function to report, without running anything, what run() would rebuild:
+    # the partitions stale now and the stages that upstream changes reach
+    def dry_run(self, force=()):
+        plan = self.plan(force)
+        changed = set()
+        lines = []
+        for stage, (deps, _) in STAGES.items():
+            step = plan[stage]
+            reason = f"{step['reason']}, " if step["reason"] else ""
+            upstream = [dep for dep in deps if dep in changed]
+            if step["stale"]:
+                changed.add(stage)
+                shown = ", ".join(map(str, step["stale"][:5]))
+                more = len(step["stale"]) - 5
+                lines.append(
+                    f"{stage}: {reason}{len(step['stale'])} of {step['total']} "
+                    f"partitions stale ({shown}{f', +{more} more' if more > 0 else ''})"
+                )
+            elif upstream:
+                changed.add(stage)
+                lines.append(
+                    f"{stage}: up to date, may rerun after {' and '.join(upstream)}"
+                )
+            else:
+                lines.append(f"{stage}: up to date")
+        return "\n".join(lines)
+
+    # Function to record the current outputs as built without running any
+    # stage, e.g. for a store built before the pipeline existed
+    def mark_built(self):
+        for stage, (_, modules) in STAGES.items():
+            partitions = self.partitions(stage)
+            self._record(stage, code_version(modules), set(partitions), True)
+
+    def _record(self, stage, code, done, rebuild):
+        manifest = read_manifest(self.manifest_path)
+        records = manifest.setdefault(self.chart_name, {})
+        record = records.get(stage, {"partitions": {}})
+        # Hash the inputs as they are after the run (e.g. a compacted year)
+        partitions = self.partitions(stage)
+        built = {} if rebuild else dict(record["partitions"])
+        built.update({p: partitions[p] for p in done if p in partitions})
+        records[stage] = {"code": code, "partitions": built}
+        write_manifest(manifest, self.manifest_path)
+
+    # Function to list the partitions of a stage without a record whose
+    # outputs already exist, to adopt them as built
+    def _adopt(self, stage, partitions):
+        return getattr(self, f"_{stage}_adopt")(partitions)
+
+    # fetch: one partition per chart week in the window, stored or missing
+    def _fetch_partitions(self):
+        return {
+            week: "stored" if self.writer.has_week(week) else "missing"
+            for week in self.weeks
+        }
+
+    # Stored weeks are final: only the missing ones are fetched
+    def _fetch_adopt(self, partitions):
+        return [week for week, state in partitions.items() if state == "stored"]
+
+    def _fetch_run(self, stale, rebuild):
+        print(f"Fetching {len(stale)} weeks of {self.chart_name}")
+        failed = fetch_weeks(
+            stale,
+            self.writer.append_week,
+            chart_name=self.chart_name,
+            workers=self.fetch_workers,
+            rate=self.fetch_rate,
+            max_retries=self.fetch_retries,
+            cache=self.cache,
+            min_entries=chart_size(self.chart_name),
+        )
+        return set(stale) - set(failed)
+
+    # normalize: one partition per year, hashed from its week files
+    def _normalize_partitions(self):
+        years = sorted({week.year for week in self.writer.stored_weeks})
+        return {
+            str(year): content_hash(partition_files(self.root, year))[:16]
+            for year in years
+        }
+
+    # Years already compacted into their single part file
+    def _normalize_adopt(self, partitions):
+        return [
+            year
+            for year in partitions
+            if [os.path.basename(path) for path in partition_files(self.root, year)]
+            == ["part-0.parquet"]
+        ]
+
+    def _normalize_run(self, stale, rebuild):
+        self.writer.compact_partitions(set(stale), force=rebuild)
+
+    # credits: the song and artist tables (new songs bring new credits)
+    def _credits_partitions(self):
+        paths = [
+            os.path.join(self.root, "artists.parquet"),
+            os.path.join(self.root, "songs.parquet"),
+        ]
+        if not all(os.path.exists(path) for path in paths):
+            return {}
+        return {"credits": content_hash(paths)[:16]}
+
+    # Credits already parsed for every stored song
+    def _credits_adopt(self, partitions):
+        credits_file = os.path.join(self.root, "credits.parquet")
+        if not partitions or not os.path.exists(credits_file):
+            return []
+        song_ids = read_parquet_mapped(credits_file, columns=["song_id"])
+        covered = pc.max(song_ids.column("song_id")).as_py()
+        return list(partitions) if covered == len(self.writer.songs) - 1 else []
+
+    def _credits_run(self, stale, rebuild):
+        self.writer.update_credits()
+
+    # genres: one partition per artist (a page to look up), plus the tagging
+    # of genres.parquet, which also depends on the taxonomy in genre_tagger
+    def _genres_partitions(self):
+        partitions = {artist: short_hash(artist) for artist in self.writer.artists}
+        partitions[GENRE_TAGS] = code_version(["genre_tagger"])
+        return partitions
+
+    # Artists already in genres.parquet, and its tags
+    def _genres_adopt(self, partitions):
+        if not os.path.exists(GENRE_FILE):
+            return []
+        looked_up = set(load_genre_tags(GENRE_FILE).frame["Artist"])
+        return [GENRE_TAGS] + [artist for artist in partitions if artist in looked_up]
+
+    def _genres_run(self, stale, rebuild):
+        artists = [artist for artist in stale if artist != GENRE_TAGS]
+        if not artists:
+            retag_genres(GENRE_FILE)
+            return None
+        looked_up = fetch_artist_genres(
+            artists, workers=self.genre_workers, cache=self.cache
+        )[["Artist", "Genre"]]
+        if os.path.exists(GENRE_FILE):
+            stored = load_genre_tags(GENRE_FILE, columns=("Artist", "Genre")).frame
+            stored = stored[~stored["Artist"].isin(looked_up["Artist"])]
+            looked_up = pd.concat([stored, looked_up], ignore_index=True)
+        # Tagging is one vectorized pass over every artist, so the tags are
+        # always rewritten with the new genres
+        write_genre_tags(looked_up, GENRE_FILE)
+        return set(stale) | {GENRE_TAGS}
+
+    # rollups: one partition per year of chart rows, plus the credits the
+    # performer rollups are grouped by
+    def _rollups_partitions(self):
+        partitions = self._normalize_partitions()
+        credits_file = os.path.join(self.root, "credits.parquet")
+        if os.path.exists(credits_file):
+            partitions["performers"] = content_hash([credits_file])[:16]
+        return partitions
+
+    # Rollups already covering every stored week
+    def _rollups_adopt(self, partitions):
+        rollups = read_rollups(self.root)
+        if rollups is None or rollups[2] != self.writer.stored_weeks:
+            return []
+        return list(partitions)
+
+    def _rollups_run(self, stale, rebuild):
+        # Rollups fold in the weeks they do not cover yet, whatever the year
+        self.writer.update_rollups(rebuild=rebuild)
+
+    # indexes: the in-memory indexes of the dashboard and the API, hashed from
+    # the files they are derived from. They are not stored: data_loader
+    # rebuilds them on load when those files change, and running this stage
+    # builds them once to check that they do and how long they take.
+    def _indexes_partitions(self):
+        if self.chart_name != DEFAULT_CHART:
+            return {}
+        return {
+            name: content_hash(paths)[:16]
+            for name, paths in dataset_cache.derived_sources().items()
+        }
+
+    # Nothing is stored: data_loader builds the indexes from the current files
+    def _indexes_adopt(self, partitions):
+        return list(partitions)
+
+    def _indexes_run(self, stale, rebuild):
+        for name in stale:
+            started = time.perf_counter()
+            dataset_cache.get(name)
+            print(f"  {name}: built in {time.perf_counter() - started:.2f}s")
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Incremental rebuild of the chart store and genre data"
+    )
+    parser.add_argument("--chart", default=DEFAULT_CHART)
+    parser.add_argument("--start", default="1990-01-01")
+    parser.add_argument("--end", default="2022-12-31")
+    parser.add_argument("--offline", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--force", nargs="+", choices=list(STAGES), default=[])
+    parser.add_argument("--mark-built", action="store_true")
+    args = parser.parse_args()
+
+    pipeline = ChartPipeline(args.chart, args.start, args.end)
+    if args.dry_run:
+        print(pipeline.dry_run(args.force))
+    elif args.mark_built:
+        pipeline.mark_built()
+        print(f"Recorded the current outputs in {pipeline.manifest_path}")
+    else:
+        # Every Billboard and Wikipedia page goes through the on-disk HTTP cache
+        pipeline.cache = HttpCache(HTTP_CACHE_DIR, offline=args.offline)
+        pipeline.run(args.force)
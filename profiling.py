@@ -0,0 +1,260 @@
+# %%
+# Opt-in instrumentation for App.py reruns.
+#
+# Set BILLBOARD_PROFILE=1 to record wall time, CPU time (of the script thread)
+# and peak traced memory for every dashboard section and profiled helper. Each
+# rerun's records are appended as JSON lines to BILLBOARD_PROFILE_LOG
+# (profile.jsonl by default) and kept in memory for p50/p99 summaries. When
+# profiling is off, start_run() returns a no-op run and profiled() returns the
+# function unchanged, so instrumented code pays only an attribute lookup.
+# Memory tracing slows Python code down severalfold; BILLBOARD_PROFILE=time
+# records wall and CPU time only. The traced peak is process-wide, so a record
+# gets a peak only if no other session's rerun ran while it was open; records
+# that overlapped another rerun have peak_kb null.
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+import weakref
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+PROFILE_ENV = "BILLBOARD_PROFILE"
+PROFILE_LOG_ENV = "BILLBOARD_PROFILE_LOG"
+PROFILE_LOG_FILE = "profile.jsonl"
+
+enabled = os.environ.get(PROFILE_ENV, "") not in ("", "0")
+trace_memory = enabled and os.environ.get(PROFILE_ENV) != "time"
+log_file = os.environ.get(PROFILE_LOG_ENV, PROFILE_LOG_FILE)
+
+# Recent wall/CPU/memory samples per section, for in-process summaries
+_history = defaultdict(lambda: deque(maxlen=1000))
+_log_lock = threading.Lock()
+# The run of the rerun executing on this thread (Streamlit runs each session's
+# script on its own thread)
+_current = threading.local()
+# Runs in progress in the process (an interrupted rerun's run is dropped with
+# its thread) and the number of runs started so far
+_active_runs = weakref.WeakSet()
+_runs_started = 0
+
+
+class NoopRun:
+    records = []
+
+    def section(self, name):
+        pass
+
+    def span(self, name):
+        return _NOOP_SPAN
+
+    def annotate(self, **fields):
+        pass
+
+    def finish(self):
+        return []
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_NOOP_RUN = NoopRun()
+
+
+class Run:
+    # Records of one rerun. Top-level sections follow each other (section()
+    # closes the previous one); spans nest inside them.
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self._stack = []
+        self._section = None
+
+    # Function to end the current top-level section and start the next one
+    def section(self, name):
+        if self._section is not None:
+            self._close(self._section)
+        self._section = self._open(name, depth=0)
+
+    # Function to measure a nested block (a helper call, a render), recorded
+    # as "<section>/<name>"
+    def span(self, name):
+        if self._section is not None:
+            name = f"{self._section['name']}/{name}"
+        return _Span(self, name)
+
+    # Function to attach extra fields (e.g. a payload size) to the innermost
+    # open record
+    def annotate(self, **fields):
+        if self._stack:
+            self._stack[-1].setdefault("fields", {}).update(fields)
+
+    # Function to close the last section, log the records and return them
+    def finish(self):
+        if self._section is not None:
+            self._close(self._section)
+            self._section = None
+        _current.run = None
+        _active_runs.discard(self)
+        for record in self.records:
+            peak_kb = record["peak_kb"]
+            _history[record["section"]].append(
+                (
+                    record["wall_ms"],
+                    record["cpu_ms"],
+                    np.nan if peak_kb is None else peak_kb,
+                )
+            )
+        with _log_lock, open(log_file, "a") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+        return self.records
+
+    def _open(self, name, depth):
+        # The enclosing record keeps the peak reached so far before it is reset
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], traced_memory()[1])
+        alone = _running_alone()
+        if trace_memory and alone:
+            # Resetting the peak would also reset other runs' peaks
+            tracemalloc.reset_peak()
+        current = traced_memory()[0]
+        entry = {
+            "alone": alone,
+            "started": _runs_started,
+            "name": name,
+            "depth": depth,
+            "wall": time.perf_counter(),
+            "cpu": time.thread_time(),
+            "memory": current,
+            "peak": current,
+        }
+        self._stack.append(entry)
+        return entry
+
+    def _close(self, entry):
+        wall = time.perf_counter() - entry["wall"]
+        cpu = time.thread_time() - entry["cpu"]
+        peak = max(entry["peak"], traced_memory()[1])
+        self._stack.remove(entry)
+        if self._stack:
+            parent = self._stack[-1]
+            parent["peak"] = max(parent["peak"], peak)
+        # Another rerun ran meanwhile: the peak may be (partly) its own
+        exclusive = (
+            entry["alone"] and _running_alone() and entry["started"] == _runs_started
+        )
+        self.records.append(
+            {
+                "run_id": self.run_id,
+                "time": time.time(),
+                "section": entry["name"],
+                "depth": entry["depth"],
+                "wall_ms": round(wall * 1000, 3),
+                "cpu_ms": round(cpu * 1000, 3),
+                "peak_kb": (
+                    round((peak - entry["memory"]) / 1024, 1) if exclusive else None
+                ),
+                **entry.get("fields", {}),
+            }
+        )
+
+
+class _Span:
+    def __init__(self, run, name):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.entry = self.run._open(self.name, depth=len(self.run._stack))
+        return self
+
+    def __exit__(self, *exc):
+        self.run._close(self.entry)
+        return False
+
+
+# Function to get the (current, peak) traced memory, or zeros when not tracing
+def traced_memory():
+    if not trace_memory:
+        return 0, 0
+    return tracemalloc.get_traced_memory()
+
+
+# Function to check whether a single run is in progress in the process
+def _running_alone():
+    return len(_active_runs) <= 1
+
+
+# Function to start recording a rerun on this thread (a no-op run when
+# profiling is off)
+def start_run():
+    global _runs_started
+    if not enabled:
+        return _NOOP_RUN
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _current.run = Run()
+    with _log_lock:
+        _active_runs.add(_current.run)
+        _runs_started += 1
+    return _current.run
+
+
+# Function to get the run recording on this thread, if any
+def current_run():
+    return getattr(_current, "run", None) or _NOOP_RUN
+
+
+# Decorator to record every call of a helper as a span of the current run
+def profiled(name=None):
+    def decorate(func):
+        if not enabled:
+            return func
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with current_run().span(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# Function to summarize the recorded samples: count, p50 and p99 per section
+def summary():
+    rows = {}
+    for section, samples in list(_history.items()):
+        wall, cpu, peak = np.array(samples).T
+        # Peaks of reruns that overlapped another one are NaN
+        peak = peak[~np.isnan(peak)]
+        rows[section] = {
+            "count": len(samples),
+            "wall_p50_ms": np.percentile(wall, 50),
+            "wall_p99_ms": np.percentile(wall, 99),
+            "cpu_p50_ms": np.percentile(cpu, 50),
+            "peak_p99_kb": np.percentile(peak, 99) if len(peak) else np.nan,
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+# Function to summarize a JSONL profile log, e.g. collected over many days
+def summarize_log(path=PROFILE_LOG_FILE):
+    records = pd.read_json(path, lines=True)
+    return records.groupby("section")[["wall_ms", "cpu_ms", "peak_kb"]].quantile(
+        [0.5, 0.99]
+    )
@@ -0,0 +1,115 @@
+# %%
+# Typeahead search over song and performer names, keyed to stable ids.
+#
+# Names are normalized (accents, case and punctuation dropped) and indexed two
+# ways: every word-start suffix of a name goes into one sorted array, so a
+# prefix of any word resolves to a contiguous range with two binary searches,
+# and every name's trigrams go into an inverted index for typo-tolerant and
+# mid-word matches. A query returns the ids of the top matches only, ranked by
+# match quality and then by popularity (weeks on the chart).
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+# Matches returned per keystroke
+SEARCH_RESULTS = 20
+
+
+# Function to normalize names for matching: ASCII, lower case, words only
+def normalize_name(text):
+    text = unicodedata.normalize("NFKD", str(text))
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.findall(r"[a-z0-9]+", text))
+
+
+# Function to list the trigrams of a normalized name, with word boundaries
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    def __init__(self, names, popularity=None, searchable=None):
+        # names: Series of display names indexed by id (0..n-1); searchable:
+        # boolean mask of the names that may be returned (all by default)
+        self.ids = names.index.to_numpy()
+        self.searchable = searchable
+        self.popularity = (
+            np.zeros(len(names))
+            if popularity is None
+            else np.asarray(popularity, dtype="float64")
+        )
+        normalized = [normalize_name(name) for name in names.astype(str)]
+
+        # Word-start suffixes: "hotline bling drake" -> "bling drake", "drake"
+        keys, key_ids, whole = [], [], []
+        grams = defaultdict(list)
+        for position, text in enumerate(normalized):
+            starts = [0] + [m.end() for m in re.finditer(" ", text)]
+            for start in starts:
+                keys.append(text[start:])
+                key_ids.append(position)
+                whole.append(start == 0)
+            for gram in trigrams(text):
+                grams[gram].append(position)
+        order = np.argsort(np.array(keys, dtype=object), kind="stable")
+        self.keys = np.array(keys, dtype=str)[order]
+        self.key_positions = np.array(key_ids, dtype="int32")[order]
+        self.key_whole = np.array(whole, dtype=bool)[order]
+        self.grams = {
+            gram: np.array(positions, dtype="int32")
+            for gram, positions in grams.items()
+        }
+
+    # Function to get the ids of the best matches for a query, optionally only
+    # among the given candidate ids; an empty query returns the most popular
+    def search(self, query, limit=SEARCH_RESULTS, candidates=None):
+        text = normalize_name(query)
+        scores = np.zeros(len(self.ids))
+        if text:
+            # Prefix of a word: 2 points, prefix of the whole name: 3 points
+            lo = np.searchsorted(self.keys, text, side="left")
+            hi = np.searchsorted(self.keys, text + "\x7f", side="left")
+            positions = self.key_positions[lo:hi]
+            np.maximum.at(scores, positions, 2.0 + self.key_whole[lo:hi])
+
+            # Shared trigrams: up to 1 point, for typos and mid-word matches
+            query_grams = trigrams(text)
+            postings = [self.grams[g] for g in query_grams if g in self.grams]
+            if postings:
+                shared = np.bincount(np.concatenate(postings), minlength=len(scores))
+                fuzzy = shared / len(query_grams)
+                scores += np.where(fuzzy >= 0.5, fuzzy, 0)
+        else:
+            scores[:] = 1.0
+
+        if self.searchable is not None:
+            scores[~self.searchable] = 0
+        if candidates is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[np.asarray(candidates)] = True
+            scores[~allowed] = 0
+        matches = np.flatnonzero(scores > 0)
+        order = np.lexsort((-self.popularity[matches], -scores[matches]))
+        return self.ids[matches[order[:limit]]]
+
+
+# Function to index the songs of a chart store by "Song Artist"; songs
+# without chart rows are not returned
+def song_search_index(chart_store):
+    songs = chart_store.songs
+    names = songs["Song"].astype(str) + " " + songs["Artist"].astype(str)
+    popularity = chart_store.song_stats["weeks_on_chart"].reindex(songs.index)
+    charted = songs.index.isin(chart_store.charted_song_ids)
+    return SearchIndex(names, popularity.fillna(0), charted)
+
+
+# Function to index the performers of a chart store by name; performers
+# without a charted song are not returned
+def artist_search_index(chart_store):
+    performers = chart_store.performers
+    popularity = chart_store.performer_stats["weeks_on_chart"].reindex(performers.index)
+    charted = chart_store.performer_song_counts() > 0
+    return SearchIndex(performers["Artist"], popularity.fillna(0), charted.to_numpy())
@@ -0,0 +1,227 @@
+# %%
+# Datasets shared by every dashboard and API process of a host.
+#
+# A publisher builds every dataset once (the chart store, the genre bitmasks
+# and all indexes) and writes them to a versioned snapshot folder: the objects
+# are pickled with protocol 5, with their arrays taken out of band into one
+# buffers.bin file, aligned. Workers started with BILLBOARD_SHARED=<folder>
+# memory-map buffers.bin read-only and unpickle the objects around it, so the
+# arrays are views of the mapped file: no parsing or index building at start,
+# and the pages are the OS page cache's, shared by all workers.
+#
+# <folder>/CURRENT names the current version. Publishing writes a new version
+# folder and then replaces CURRENT atomically; workers notice the change like
+# any changed source file (see data_loader.py) and attach the new version on
+# their next rerun, without a restart. The last KEEP_VERSIONS versions are
+# kept so that workers still attaching an older one find its files. A worker
+# that cannot attach the current version (published by other code, pruned or
+# damaged) loads its datasets privately until the next version.
+#
+# Attaching unpickles the snapshot, which can run arbitrary code: the folder
+# of BILLBOARD_SHARED must be trusted and writable only by the publisher's
+# user, like the code itself.
+#
+#   python shared_datasets.py                  publish to SHARED_DIR
+#   python shared_datasets.py --bench 4        compare 4 private and 4 shared workers
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import time
+
+SHARED_DIR = "shared_datasets"
+KEEP_VERSIONS = 2
+# Buffers below this size stay in the pickle stream
+MIN_SHARED_BUFFER = 4096
+BUFFER_ALIGNMENT = 64
+# Modules whose classes are pickled into a snapshot: a worker only attaches
+# snapshots published by the same code
+SNAPSHOT_MODULES = [
+    "chart_store",
+    "chart_index",
+    "chart_rollups",
+    "artist_credits",
+    "genre_tagger",
+    "search_index",
+]
+
+
+# Function to hash the code of the snapshot modules (next to this file)
+def snapshot_code_version():
+    folder = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for module in SNAPSHOT_MODULES:
+        with open(os.path.join(folder, f"{module}.py"), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+# Function to get the path of the pointer to the current version
+def current_path(root=SHARED_DIR):
+    return os.path.join(root, "CURRENT")
+
+
+# Function to read the current version (None if nothing was published)
+def current_version(root=SHARED_DIR):
+    try:
+        with open(current_path(root)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# Function to publish datasets (name -> value) as a snapshot versioned by the
+# sources they were built from, and make it current; returns the version
+def write_snapshot(values, sources, root=SHARED_DIR, keep=KEEP_VERSIONS):
+    code = snapshot_code_version()
+    version = hashlib.sha256(f"{sources}\0{code}".encode()).hexdigest()[:16]
+    folder = os.path.join(root, version)
+    if not os.path.exists(folder):
+        staging = f"{folder}.tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        manifest = {"version": version, "code": code, "datasets": {}}
+        with open(os.path.join(staging, "buffers.bin"), "wb") as buffers_file:
+            for name, value in values.items():
+                manifest["datasets"][name] = _write_dataset(
+                    name, value, staging, buffers_file
+                )
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(staging, folder)
+
+    with open(current_path(root) + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(current_path(root) + ".tmp", current_path(root))
+    _prune_versions(root, version, keep)
+    return version
+
+
+# Function to pickle one dataset, appending its large buffers to buffers_file;
+# returns the (offset, length) of each buffer in the file
+def _write_dataset(name, value, folder, buffers_file):
+    spans = []
+
+    def take_out_of_band(buffer):
+        data = buffer.raw()
+        if data.nbytes < MIN_SHARED_BUFFER:
+            return True
+        offset = buffers_file.tell()
+        padding = -offset % BUFFER_ALIGNMENT
+        buffers_file.write(b"\0" * padding)
+        buffers_file.write(data)
+        spans.append((offset + padding, data.nbytes))
+        return False
+
+    with open(os.path.join(folder, f"{name}.pickle"), "wb") as f:
+        pickle.dump(value, f, protocol=5, buffer_callback=take_out_of_band)
+    return spans
+
+
+# Function to delete all but the newest versions (and the current one)
+def _prune_versions(root, current, keep):
+    folders = [
+        os.path.join(root, name)
+        for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)) and not name.endswith(".tmp")
+    ]
+    folders.sort(key=os.path.getmtime, reverse=True)
+    for folder in folders[keep:]:
+        if os.path.basename(folder) != current:
+            # Workers still mapping its buffers keep them until they swap
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+# Function to attach the current snapshot read-only: returns its version and
+# its datasets (name -> value), whose arrays are views of the mapped buffers
+def attach_snapshot(root=SHARED_DIR):
+    version = current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No snapshot published in {root}")
+    folder = os.path.join(root, version)
+    with open(os.path.join(folder, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["code"] != snapshot_code_version():
+        raise ValueError(
+            f"Snapshot {version} was published by other code than this worker's"
+        )
+
+    with open(os.path.join(folder, "buffers.bin"), "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        # The mapping stays open as long as arrays point into it
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+    view = memoryview(mapped)
+    values = {}
+    for name, spans in manifest["datasets"].items():
+        with open(os.path.join(folder, f"{name}.pickle"), "rb") as f:
+            values[name] = pickle.load(
+                f, buffers=[view[offset : offset + length] for offset, length in spans]
+            )
+    return version, values
+
+
+# Function to report a process's memory in MB: private (anonymous) pages and
+# file-backed pages, which mapped snapshots share between processes
+def memory_usage():
+    usage = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                usage[line.split(":")[0]] = int(line.split()[1]) / 1024
+    return usage
+
+
+# Function to start workers that load every dataset, privately or from the
+# shared snapshot, and report how long it took and the memory they hold
+def bench(workers, root=SHARED_DIR):
+    script = (
+        "import json, time; started = time.perf_counter()\n"
+        "from data_loader import dataset_cache, load_dataset\n"
+        "for name in dataset_cache.names(): load_dataset(name)\n"
+        "from shared_datasets import memory_usage\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started, "
+        "**memory_usage()}))"
+    )
+    for mode, shared in (("private", ""), ("shared", root)):
+        env = {**os.environ, "BILLBOARD_SHARED": shared}
+        processes = [
+            subprocess.Popen(
+                [sys.executable, "-c", script], env=env, stdout=subprocess.PIPE
+            )
+            for _ in range(workers)
+        ]
+        results = [json.loads(p.communicate()[0]) for p in processes]
+        print(
+            f"{workers} {mode} workers: "
+            f"start {max(r['seconds'] for r in results):.2f}s, "
+            f"private {sum(r['RssAnon'] for r in results) / workers:.0f} MB "
+            f"and mapped {sum(r['RssFile'] for r in results) / workers:.0f} MB "
+            "per worker"
+        )
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Publish the datasets for workers to share"
+    )
+    parser.add_argument("--dir", default=SHARED_DIR)
+    parser.add_argument("--bench", type=int, metavar="WORKERS")
+    args = parser.parse_args()
+
+    # Imported here: data_loader attaches snapshots through this module
+    from data_loader import publish_shared
+
+    started = time.perf_counter()
+    version = publish_shared(args.dir)
+    print(
+        f"Published version {version} to {args.dir} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    if args.bench:
+        bench(args.bench, args.dir)
@@ -0,0 +1,280 @@
+# %%
+# Email subscriptions for the "next year's charts" notification.
+#
+# Signups are queued in memory and written behind by one thread per process,
+# in batches, to a SQLite database in WAL mode, so a dashboard rerun never
+# waits on the disk. Emails are normalized (trimmed, lower case) and unique
+# in the database: a repeated signup is ignored, whichever process or session
+# it comes from. Several processes may write at once; SQLite serializes their
+# batches and WAL lets the export read while they do.
+#
+#   python subscriptions.py --export emails.csv       export every subscription
+#   python subscriptions.py --import user_emails.txt  add the emails of a file
+#   python subscriptions.py --load-test 8             signups from 8 processes
+import argparse
+import atexit
+import logging
+import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+SUBSCRIPTIONS_DB = "subscriptions.db"
+# Signups written per transaction, at most
+FLUSH_BATCH = 500
+# Seconds a signup may wait in the queue before it is written
+FLUSH_INTERVAL = 0.5
+# Seconds to wait for another process's write to finish
+BUSY_TIMEOUT = 30
+# Seconds flush() waits for the queued signups to be written, at most
+FLUSH_TIMEOUT = 2 * BUSY_TIMEOUT
+
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    subscribed_at TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS subscriptions_email ON subscriptions (email);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+# Function to normalize an email address, or None if it is not one
+def normalize_email(text):
+    email = str(text).strip().lower()
+    if len(email) > 254 or not EMAIL_PATTERN.fullmatch(email):
+        return None
+    return email
+
+
+# Function to open a connection to the database, creating it if needed
+def connect(path):
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SubscriptionStore:
+    def __init__(
+        self,
+        path=SUBSCRIPTIONS_DB,
+        batch_size=FLUSH_BATCH,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "queued": 0,
+            "written": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "batches": 0,
+        }
+
+    # Function to queue a signup; returns the normalized email, or None if
+    # the address is not valid (nothing is queued then)
+    def subscribe(self, email, source="dashboard"):
+        email = normalize_email(email)
+        if email is None:
+            return None
+        self._start_writer()
+        subscribed_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self._queue.put((email, subscribed_at, source))
+        with self._lock:
+            self._stats["queued"] += 1
+        return email
+
+    # Function to wait until every queued signup of this process is written
+    # (or failed), for up to timeout seconds; returns whether none is left
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        if self._writer is None:
+            return True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(
+                        "%d subscriptions still queued after %ss",
+                        self._queue.unfinished_tasks,
+                        timeout,
+                    )
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    # Function to export the subscriptions (optionally only those made at or
+    # after since, a timestamp) as a frame in signup order, after writing the
+    # ones still queued in this process
+    def export(self, since=None):
+        self.flush()
+        connection = connect(self.path)
+        try:
+            query = "SELECT email, subscribed_at, source FROM subscriptions"
+            params = ()
+            if since is not None:
+                query += " WHERE subscribed_at >= ?"
+                params = (pd.Timestamp(since).strftime("%Y-%m-%dT%H:%M:%SZ"),)
+            return pd.read_sql_query(query + " ORDER BY id", connection, params=params)
+        finally:
+            connection.close()
+
+    # Function to report the signups of this process: queued, written, and
+    # ignored as duplicates
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": self._queue.qsize()}
+
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_behind, name="subscriptions", daemon=True
+                )
+                self._writer.start()
+                # Write what is still queued when the process exits normally
+                atexit.register(self.flush)
+
+    # Writer thread: collect signups for up to flush_interval seconds (or
+    # batch_size of them) and insert them in one transaction. A failed batch
+    # is logged and dropped, and the next one reconnects
+    def _write_behind(self):
+        connection = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    )
+                except queue.Empty:
+                    break
+            try:
+                if connection is None:
+                    connection = connect(self.path)
+                written = self._write_batch(connection, batch)
+                with self._lock:
+                    self._stats["written"] += written
+                    self._stats["duplicates"] += len(batch) - written
+                    self._stats["batches"] += 1
+            except Exception:
+                # Keep the writer alive; the batch is lost, as the old file
+                # append would have lost it
+                logger.exception("Could not write %d subscriptions", len(batch))
+                with self._lock:
+                    self._stats["failed"] += len(batch)
+                if connection is not None:
+                    connection.close()
+                    connection = None
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, connection, batch):
+        # BEGIN IMMEDIATE takes the write lock up front, waiting out other
+        # processes' batches for up to BUSY_TIMEOUT seconds
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO subscriptions (email, subscribed_at, source) "
+                "VALUES (?, ?, ?)",
+                batch,
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return connection.total_changes - before
+
+
+# The store of this process, shared by all dashboard sessions
+subscription_store = SubscriptionStore()
+
+
+# Function to subscribe a worker's share of the load test's emails
+def _load_test_worker(path, emails):
+    store = SubscriptionStore(path)
+    for email in emails:
+        store.subscribe(email, source="load-test")
+    store.flush()
+    return store.stats()
+
+
+# Function to sign up overlapping emails (in varying case) from several
+# processes at once and check that each one is stored exactly once
+def load_test(workers, signups_per_worker=5000, path=None):
+    path = path or os.path.join(tempfile.mkdtemp(), SUBSCRIPTIONS_DB)
+    distinct = signups_per_worker * workers // 2
+    shares = [
+        [
+            f"fan{(worker * 7919 + i) % distinct}@example.com"
+            for i in range(signups_per_worker)
+        ]
+        for worker in range(workers)
+    ]
+    # The same addresses as typed in other ways
+    for share in shares:
+        share[::3] = [f" {email.upper()}" for email in share[::3]]
+    expected = {normalize_email(email) for share in shares for email in share}
+    connect(path).close()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        stats = list(pool.map(_load_test_worker, [path] * workers, shares))
+    elapsed = time.perf_counter() - started
+    stored = SubscriptionStore(path).export()["email"]
+    print(
+        f"{workers * signups_per_worker} signups from {workers} processes in "
+        f"{elapsed:.2f}s ({sum(s['batches'] for s in stats)} batches), "
+        f"{len(stored)} stored of {len(expected)} distinct: "
+        f"{'ok' if stored.is_unique and set(stored) == expected else 'MISMATCH'}"
+    )
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Email subscriptions")
+    parser.add_argument("--db", default=SUBSCRIPTIONS_DB)
+    parser.add_argument("--export", metavar="CSV")
+    parser.add_argument("--since", help="export the signups from this date on")
+    parser.add_argument("--import", dest="import_file", metavar="TXT")
+    parser.add_argument("--load-test", type=int, metavar="WORKERS")
+    args = parser.parse_args()
+
+    if args.load_test:
+        load_test(args.load_test)
+    else:
+        store = SubscriptionStore(args.db)
+        if args.import_file:
+            with open(args.import_file) as f:
+                rejected = [
+                    line.strip()
+                    for line in f
+                    if line.strip() and store.subscribe(line, source="import") is None
+                ]
+            store.flush()
+            print(f"Imported {args.import_file}: {store.stats()}")
+            if rejected:
+                print(f"Skipped {len(rejected)} invalid addresses")
+        if args.export:
+            subscriptions = store.export(args.since)
+            subscriptions.to_csv(args.export, index=False)
+            print(f"Exported {len(subscriptions)} subscriptions to {args.export}")
@@ -0,0 +1,6 @@
+# %%
+# Shared fixtures: the modules under test live in the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+# %%
+# Local stub of billboard.com for the fetcher tests.
+#
+# Serves /charts/<chart>/<week> pages in the markup billboard.py parses. Every
+# path answers with its scripted responses in order (a status code, or "page"
+# / "empty" / "gap" for a 200 with a full chart, an entry-less one or a full
+# one missing rank 2), repeating the last one; unscripted paths get a full
+# page of `entries` entries. Requests are counted per path.
+import http.server
+import threading
+from collections import Counter
+
+ROW = (
+    '<ul class="o-chart-results-list-row"><li><span class="c-label">{rank}</span>'
+    '</li><li></li><li></li><li><h3 id="title-of-a-story">Song {rank} {week}</h3>'
+    '<span class="c-label">Artist {artist}</span><ul><li>-</li><li>-</li>'
+    "<li>-</li><li>{rank}</li><li>1</li><li>1</li></ul></li></ul>"
+)
+
+
+# Function to render a chart page with the given ranks
+def chart_page(week, ranks):
+    rows = "".join(ROW.format(rank=rank, week=week, artist=rank % 7) for rank in ranks)
+    return f"<html><body>{rows}</body></html>"
+
+
+class StubBillboard:
+    def __init__(self, script=None, entries=100):
+        self.script = script or {}
+        self.requests = Counter()
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests[self.path] += 1
+                responses = stub.script.get(self.path, ["page"])
+                response = responses[min(stub.requests[self.path], len(responses)) - 1]
+                if isinstance(response, int):
+                    self.send_response(response)
+                    self.end_headers()
+                    return
+                week = self.path.rsplit("/", 1)[1]
+                ranks = {
+                    "page": range(1, entries + 1),
+                    "empty": [],
+                    "gap": [1, *range(3, entries + 1)],
+                }[response]
+                body = chart_page(week, ranks).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/charts"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,39 @@
+# %%
+# API parameter validation, through Flask's test client on the committed data
+import os
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Function to get a test client of the API, loading the data of the repo
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.chdir(REPO)
+    from api import app
+
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/api/songs/longest?start=",
+        "/api/songs/longest?end=NaT",
+        "/api/songs/longest?start=not-a-date",
+        "/api/export?end=",
+        "/api/charts/nat",
+    ],
+)
+def test_bad_dates_are_rejected(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert "must be a date (YYYY-MM-DD)" in response.get_json()["error"]
+
+
+def test_good_dates_are_answered(client):
+    response = client.get("/api/songs/longest?start=2000-01-01&end=2000-12-31")
+    assert response.status_code == 200
+    assert response.get_json()["items"]
+    assert client.get("/api/charts/2005-06-12").get_json()["week"] == "2005-06-12"
@@ -0,0 +1,91 @@
+# %%
+# Fetcher tests against a local stub of billboard.com (see stub_billboard.py)
+from chart_fetcher import fetch_weeks
+from http_cache import HttpCache
+from stub_billboard import StubBillboard
+
+WEEK = "2000-01-02"
+PATH = f"/charts/hot-100/{WEEK}"
+
+
+# Function to fetch weeks from a stub quickly, collecting what is handed over
+def fetch(stub, weeks, cache=None, max_retries=2, chart_name="hot-100"):
+    stored = {}
+    failed = fetch_weeks(
+        weeks,
+        lambda week, entries: stored.update({week: entries}),
+        chart_name=chart_name,
+        workers=2,
+        rate=100,
+        burst=10,
+        base_url=stub.base_url,
+        max_retries=max_retries,
+        backoff=0.01,
+        cache=cache,
+    )
+    return stored, failed
+
+
+def test_retries_a_server_error_then_stores_the_week():
+    with StubBillboard({PATH: [503, "page"]}) as stub:
+        stored, failed = fetch(stub, [WEEK])
+    assert failed == {}
+    assert len(stored[WEEK]) == 100
+    assert stored[WEEK][0] == ("Artist 1", f"Song 1 {WEEK}", 1)
+    assert stub.requests[PATH] == 2
+
+
+def test_gives_up_after_the_retries():
+    with StubBillboard({PATH: [503]}) as stub:
+        stored, failed = fetch(stub, [WEEK], max_retries=2)
+    assert WEEK in failed
+    assert stored == {}
+    assert stub.requests[PATH] == 3
+
+
+def test_empty_page_is_a_failed_fetch_and_not_cached(tmp_path):
+    cache = HttpCache(str(tmp_path / "http_cache"))
+    with StubBillboard({PATH: ["empty"]}) as stub:
+        stored, failed = fetch(stub, [WEEK], cache=cache, max_retries=1)
+    assert WEEK in failed
+    assert stored == {}
+    assert cache.stats()["entries"] == 0
+
+    # Once the page is complete again it is fetched, not served from the cache
+    with StubBillboard() as stub:
+        stored, failed = fetch(stub, [WEEK], cache=cache)
+    assert failed == {}
+    assert len(stored[WEEK]) == 100
+    assert stub.requests[PATH] == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_empty_page_recovers_on_retry():
+    with StubBillboard({PATH: ["empty", "page"]}) as stub:
+        stored, failed = fetch(stub, [WEEK])
+    assert failed == {}
+    assert len(stored[WEEK]) == 100
+
+
+def test_page_with_a_rank_gap_is_retried():
+    with StubBillboard({PATH: ["gap", "page"]}) as stub:
+        stored, failed = fetch(stub, [WEEK])
+    assert failed == {}
+    assert len(stored[WEEK]) == 100
+    assert stub.requests[PATH] == 2
+
+
+def test_short_chart_is_complete_when_ranks_run_through():
+    path = f"/charts/hot-country-songs/{WEEK}"
+    with StubBillboard(entries=50) as stub:
+        stored, failed = fetch(stub, [WEEK], chart_name="hot-country-songs")
+    assert failed == {}
+    assert [rank for _, _, rank in stored[WEEK]] == list(range(1, 51))
+    assert stub.requests[path] == 1
+
+
+def test_short_hot_100_page_is_a_failed_fetch():
+    with StubBillboard(entries=50) as stub:
+        stored, failed = fetch(stub, [WEEK], max_retries=1)
+    assert "only 50 of 100 chart entries" in str(failed[WEEK])
+    assert stored == {}
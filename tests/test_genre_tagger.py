@@ -0,0 +1,43 @@
+# %%
+# Genre tagging of raw Wikipedia genre text
+import pandas as pd
+import pytest
+
+from genre_tagger import GENRE_TAXONOMY, tag_genres
+
+
+# Function to get the genres tagged for one genre text
+def genres(text):
+    mask = int(tag_genres(pd.Series([text]))[0])
+    return {genre for bit, genre in enumerate(GENRE_TAXONOMY) if mask >> bit & 1}
+
+
+@pytest.mark.parametrize(
+    "glued, hyphenated, tagged",
+    [
+        ("synthpop", "synth-pop", {"synth"}),
+        ("Britpop", "Brit-pop", {"brit"}),
+        ("electropop", "electro-pop", set()),
+    ],
+)
+def test_compounds_are_tagged_alike_in_any_spelling(glued, hyphenated, tagged):
+    assert genres(glued) == genres(hyphenated) == tagged
+
+
+def test_whole_words_longest_phrase_first():
+    assert genres("Hard rock, dance-pop") == {"hard rock", "dance", "pop"}
+    assert genres("Hip-hop, rhythm and blues[1]") == {"hip hop", "r&b"}
+
+
+def test_glued_items_are_split_but_not_inside_compounds():
+    assert genres("Pop rockhard rock") == {"pop", "rock", "hard rock"}
+    assert genres("FolkBlues") == {"folk", "blues"}
+    assert genres("Popelectropopdance") == {"pop", "dance"}
+    assert genres("R&Bdancehallhip hop") == {"r&b", "hip hop"}
+    assert genres("Indie popelectronicalternative dance") == {
+        "indie",
+        "pop",
+        "electronic",
+        "alternative",
+        "dance",
+    }
@@ -0,0 +1,84 @@
+# %%
+# Pipeline tests on a copy of the committed chart store and genre tags, and
+# on a new chart fetched from a local stub of billboard.com
+import functools
+import os
+import shutil
+
+import pytest
+
+import pipeline as pipeline_module
+from chart_fetcher import fetch_weeks
+from chart_store import CHART_STORE_DIR, DEFAULT_CHART
+from genre_tagger import GENRE_FILE
+from pipeline import STAGES, ChartPipeline, read_manifest
+from stub_billboard import StubBillboard
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Function to work in a copy of the store, as a fresh checkout: no manifest
+@pytest.fixture
+def checkout(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(REPO, CHART_STORE_DIR), tmp_path / CHART_STORE_DIR)
+    shutil.copy(os.path.join(REPO, GENRE_FILE), tmp_path / GENRE_FILE)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+# Function to create a pipeline over weeks that are all in the store
+def pipeline(checkout):
+    return ChartPipeline(
+        start="2000-01-01",
+        end="2000-12-30",
+        manifest_path=str(checkout / "pipeline.json"),
+    )
+
+
+def test_dry_run_without_manifest_adopts_the_store(checkout):
+    plan = pipeline(checkout).plan()
+    assert {stage: step["stale"] for stage, step in plan.items()} == {
+        stage: [] for stage in STAGES
+    }
+    assert len(plan["fetch"]["adopted"]) == plan["fetch"]["total"] == 52
+    report = pipeline(checkout).dry_run()
+    assert "stale" not in report
+    assert not os.path.exists(checkout / "pipeline.json")
+
+
+def test_first_run_records_the_adopted_store(checkout):
+    pipeline(checkout).run()
+    manifest = read_manifest(str(checkout / "pipeline.json"))
+    assert set(manifest[DEFAULT_CHART]) == set(STAGES)
+    plan = pipeline(checkout).plan()
+    assert all(not step["stale"] and not step["adopted"] for step in plan.values())
+    assert all(step["reason"] is None for step in plan.values())
+
+
+def test_missing_weeks_are_the_only_ones_fetched(checkout):
+    plan = ChartPipeline(
+        start="2000-01-01",
+        end="2000-12-31",
+        manifest_path=str(checkout / "pipeline.json"),
+    ).plan(stages=["fetch"])
+    assert plan["fetch"]["stale"] == ["2000-12-31"]
+
+
+def test_fetches_a_short_chart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    chart = ChartPipeline(
+        "hot-country-songs",
+        start="2000-01-01",
+        end="2000-01-16",
+        manifest_path=str(tmp_path / "pipeline.json"),
+    )
+    with StubBillboard(entries=50) as stub:
+        monkeypatch.setattr(
+            pipeline_module,
+            "fetch_weeks",
+            functools.partial(fetch_weeks, base_url=stub.base_url, backoff=0.01),
+        )
+        stale = chart.plan(stages=["fetch"])["fetch"]["stale"]
+        assert chart._fetch_run(stale, False) == set(stale)
+    assert len(stale) == 3
+    assert chart.plan(stages=["fetch"])["fetch"]["stale"] == []
@@ -0,0 +1,49 @@
+# %%
+# Attaching shared snapshots, with a small stand-in for the private datasets
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import data_loader
+from data_loader import DatasetCache, shared_dataset_cache
+from shared_datasets import current_version, write_snapshot
+
+PRIVATE = np.arange(10_000)
+
+
+# Function to stand in for the datasets this process would load itself
+@pytest.fixture(autouse=True)
+def private_datasets(tmp_path, monkeypatch):
+    source = tmp_path / "numbers.txt"
+    source.write_text("private")
+
+    def private_dataset_cache():
+        cache = DatasetCache()
+        cache.register("numbers", [str(source)], lambda: PRIVATE)
+        return cache
+
+    monkeypatch.setattr(data_loader, "private_dataset_cache", private_dataset_cache)
+
+
+def test_attaches_the_published_snapshot(tmp_path):
+    root = str(tmp_path / "shared")
+    write_snapshot({"numbers": np.arange(10_000) * 2}, "v1", root)
+    numbers = shared_dataset_cache(root).get("numbers")
+    assert numbers[-1] == 19_998
+    assert not numbers.flags.writeable
+
+
+@pytest.mark.parametrize("damage", ["pruned", "truncated"])
+def test_falls_back_to_private_loading(tmp_path, damage, caplog):
+    root = str(tmp_path / "shared")
+    write_snapshot({"numbers": np.arange(10_000) * 2}, "v1", root)
+    folder = os.path.join(root, current_version(root))
+    if damage == "pruned":
+        shutil.rmtree(folder)
+    else:
+        with open(os.path.join(folder, "numbers.pickle"), "r+b") as f:
+            f.truncate(10)
+    assert shared_dataset_cache(root).get("numbers") is PRIVATE
+    assert "loading the datasets privately" in caplog.text
@@ -0,0 +1,41 @@
+# %%
+# Write-behind subscription store tests on temporary databases
+from subscriptions import SubscriptionStore, connect
+
+
+def test_signups_are_normalized_and_stored_once(tmp_path):
+    store = SubscriptionStore(str(tmp_path / "subscriptions.db"), flush_interval=0.01)
+    assert store.subscribe(" Fan@Example.com ") == "fan@example.com"
+    assert store.subscribe("fan@example.com") == "fan@example.com"
+    assert store.subscribe("not an email") is None
+    assert list(store.export()["email"]) == ["fan@example.com"]
+    assert store.stats()["written"] == 1
+    assert store.stats()["duplicates"] == 1
+
+
+def test_failed_batches_are_logged_and_do_not_block_flush(tmp_path, caplog):
+    # The database cannot be opened: its folder does not exist
+    store = SubscriptionStore(str(tmp_path / "missing" / "db"), flush_interval=0.01)
+    store.subscribe("fan@example.com")
+    assert store.flush(timeout=5)
+    assert store.stats()["failed"] == 1
+    assert "Could not write 1 subscriptions" in caplog.text
+
+    # The writer is still alive and reconnects once the folder exists
+    (tmp_path / "missing").mkdir()
+    store.subscribe("other@example.com")
+    assert store.flush(timeout=5)
+    assert store.stats()["written"] == 1
+
+
+def test_flush_gives_up_after_the_timeout(tmp_path):
+    path = str(tmp_path / "subscriptions.db")
+    store = SubscriptionStore(path, flush_interval=0.01)
+    # Another process holds the write lock
+    other = connect(path)
+    other.execute("BEGIN IMMEDIATE")
+    store.subscribe("fan@example.com")
+    assert not store.flush(timeout=0.2)
+    other.execute("COMMIT")
+    assert store.flush(timeout=5)
+    assert store.stats()["written"] == 1